@@ -0,0 +1,66 @@
+"""
+Images and fonts that get used on every frame, loaded once per process.
+"""
+
+from functools import lru_cache
+import os
+import random
+
+import PIL.Image
+import PIL.ImageFont
+
+from config import IMAGE_SIZE, DUCK_IMAGE_DIR, ASSET_CACHE_SIZE
+
+FONT_LOCATION = os.path.join(
+    os.path.dirname(__file__), 'fonts', 'lato', 'Lato-Bold.ttf',
+)
+ICON_DIR = os.path.join(os.path.dirname(__file__), 'icons')
+
+
+@lru_cache(maxsize=1)
+def duck_sprite_names():
+    return tuple(sorted(
+        fn for fn in os.listdir(DUCK_IMAGE_DIR)
+        if fn.endswith('.png') and not fn.startswith('.')
+    ))
+
+
+@lru_cache(maxsize=ASSET_CACHE_SIZE)
+def duck_sprite(filename):
+    """
+    Return the duck sprite called filename, scaled to the height it gets drawn
+    at.
+    """
+
+    duck_image = PIL.Image.open(os.path.join(DUCK_IMAGE_DIR, filename))
+    target_height = int(IMAGE_SIZE[1]*0.75)
+    target_width = int(
+        duck_image.width * (target_height / duck_image.height)
+    )
+    return duck_image.resize((
+        target_width, target_height,
+    ), resample=PIL.Image.ANTIALIAS)
+
+
+def random_duck_sprite():
+    return duck_sprite(random.choice(duck_sprite_names()))
+
+
+@lru_cache(maxsize=ASSET_CACHE_SIZE)
+def get_font(size):
+    return PIL.ImageFont.truetype(FONT_LOCATION, size)
+
+
+@lru_cache(maxsize=ASSET_CACHE_SIZE)
+def get_icon(filename):
+    return PIL.Image.open(os.path.join(ICON_DIR, filename)).convert('RGBA')
+
+
+def warm():
+    """
+    Load everything we can ahead of time, so that the first frame we render
+    is as quick as the rest.
+    """
+
+    for filename in duck_sprite_names():
+        duck_sprite(filename)
@@ -0,0 +1,279 @@
+"""
+Time the things that happen on every tick, using only local fixtures, and
+write the results out as JSON so that they can be compared between commits.
+
+    python benchmark.py --output before.json
+    python benchmark.py --compare before.json
+"""
+
+from argparse import ArgumentParser
+from io import BytesIO
+import json
+import os
+import platform
+import random
+from statistics import median
+import subprocess
+import sys
+import timeit
+
+from camel import Camel
+from django.contrib.gis.geos import Point
+import PIL.Image
+
+import assets
+from config import IMAGE_SIZE
+from duck import Duck, dump_duck, load_duck, registry
+import network
+import route
+from route import PlaceIndex
+from scenario import SCENARIO_DIR, catalog, parse_scenario
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+
+def _route(points, seed=0):
+    """
+    Make a wiggly route of the given number of points heading roughly north
+    from Valley Brook.
+    """
+
+    rng = random.Random(seed)
+    lat, lon = 53.095943, -2.469436
+    coords = []
+
+    for i in range(points):
+        lat += 0.0005 + (rng.random() * 0.001)
+        lon += (rng.random() - 0.5) * 0.001
+        coords.append((lat, lon))
+
+    return coords
+
+
+def _places(count, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'name': 'Place {}'.format(i),
+        'point': Point(
+            50 + (rng.random() * 8), -6 + (rng.random() * 8), srid=4326,
+        ),
+    } for i in range(count)]
+
+
+def _image(size, colour):
+    buffer = BytesIO()
+    PIL.Image.new(mode='RGB', size=size, color=colour).save(
+        buffer, format='PNG',
+    )
+    return buffer.getvalue()
+
+
+def _duck(points):
+    d = Duck(_route(points))
+    d.progress = d.total_distance() * 0.6
+    return d
+
+
+for _points in (50, 5000):
+    @benchmark('get_position[{}]'.format(_points))
+    def _get_position(points=_points):
+        d = _duck(points)
+        return d.get_position
+
+    @benchmark('get_travel[{}]'.format(_points))
+    def _get_travel(points=_points):
+        d = _duck(points)
+        return d.get_travel
+
+    @benchmark('duck_init[{}]'.format(_points))
+    def _duck_init(points=_points):
+        ls = _route(points)
+        return lambda: Duck(ls)
+
+
+for _count in (len(route.get_places()), 10000, 50000):
+    @benchmark('random_point_near[{}]'.format(_count))
+    def _random_point_near(count=_count):
+        places = _places(count)
+        index = PlaceIndex(places)
+        point = Point(53.095943, -2.469436, srid=4326)
+        exclude = [places[0]['point']]
+        original = route.get_place_index
+
+        def run():
+            route.get_place_index = lambda: index
+            try:
+                route.random_point_near(point, experience=5, exclude=exclude)
+            finally:
+                route.get_place_index = original
+
+        return run
+
+
+@benchmark('parse_scenarios')
+def _parse_scenarios():
+    filenames = [
+        os.path.join(SCENARIO_DIR, fn) for fn in sorted(os.listdir(
+            SCENARIO_DIR
+        )) if fn.endswith('.txt') and not fn.startswith('.')
+    ]
+
+    def run():
+        for filename in filenames:
+            parse_scenario(filename)
+
+    return run
+
+
+@benchmark('outcome_for')
+def _outcome_for():
+    scenarios = list(catalog)
+    rng = random.Random(0)
+
+    def run():
+        for scenario in scenarios:
+            for answer in scenario.answers:
+                scenario.outcome_for(answer['answer'], rng=rng)
+
+    return run
+
+
+@benchmark('make_image')
+def _make_image():
+    images = {
+        'streetview': _image(IMAGE_SIZE, (120, 160, 90)),
+        'staticmap': _image((160, 160), (230, 230, 220)),
+    }
+    d = _duck(500)
+
+    # every sprite loaded and scaled up front, and the same ones drawn in the
+    # same order every run, so that runs can be compared
+    assets.warm()
+    random.seed(0)
+
+    def fake_fetch(url):
+        return BytesIO(images[
+            'streetview' if '/streetview?' in url else 'staticmap'
+        ])
+
+    def run():
+        original = network.fetch_cached
+        network.fetch_cached = fake_fetch
+        try:
+            d.make_image()
+        finally:
+            network.fetch_cached = original
+
+    return run
+
+
+@benchmark('dump_duck[500]')
+def _dump_duck():
+    d = _duck(500)
+    d.scenario = d.last_scenario = next(iter(catalog))
+    return lambda: dump_duck(d)
+
+
+@benchmark('load_duck[500]')
+def _load_duck():
+    d = _duck(500)
+    d.scenario = d.last_scenario = next(iter(catalog))
+    dumped = dump_duck(d)
+    return lambda: load_duck(dumped)
+
+
+@benchmark('camel_dump[500]')
+def _camel_dump():
+    camel = Camel([registry])
+    d = _duck(500)
+    d.scenario = d.last_scenario = next(iter(catalog))
+    return lambda: camel.dump(d)
+
+
+@benchmark('camel_load[500]')
+def _camel_load():
+    camel = Camel([registry])
+    d = _duck(500)
+    d.scenario = d.last_scenario = next(iter(catalog))
+    dumped = camel.dump(d)
+    return lambda: camel.load(dumped)
+
+
+def run_benchmarks(pattern=None, repeat=5):
+    results = {}
+
+    for name, setup in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+
+        timer = timeit.Timer(setup())
+        number, _ = timer.autorange()
+        times = [
+            t / number for t in timer.repeat(repeat=repeat, number=number)
+        ]
+        results[name] = {
+            'number': number,
+            'best': min(times),
+            'median': median(times),
+        }
+        print('{:<28} {:>12.1f} µs'.format(name, min(times) * 1e6),
+              file=sys.stderr)
+
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after):
+    for name, result in sorted(after['results'].items()):
+        previous = before['results'].get(name)
+        if previous is None:
+            change = 'new'
+        else:
+            change = '{:.2f}x'.format(previous['best'] / result['best'])
+        print('{:<28} {:>12.1f} µs {:>10}'.format(
+            name, result['best'] * 1e6, change))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--filter', default=None,
+                        help='only run benchmarks with this in their name')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None,
+                        help='where to write results; stdout by default')
+    parser.add_argument('--compare', default=None,
+                        help='results from an earlier run to compare with')
+    args = parser.parse_args()
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'results': run_benchmarks(pattern=args.filter, repeat=args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
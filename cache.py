@@ -0,0 +1,154 @@
+import sqlite3
+from threading import Lock
+import time
+
+
+class Cache:
+    """
+    A persistent store of values by key, kept in an SQLite database.
+
+    Once there are more than max_entries entries, or the values stored add up
+    to more than max_bytes bytes, the least recently used ones are evicted. If
+    ttl (in hours) is given, entries older than that are treated as missing.
+    """
+
+    def __init__(self, location, max_entries=None, max_bytes=None, ttl=None):
+        self.location = location
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = Lock()
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.location, check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS cache ('
+                    'key TEXT PRIMARY KEY, '
+                    'value BLOB NOT NULL, '
+                    'created REAL NOT NULL, '
+                    'accessed REAL NOT NULL'
+                    ')'
+                )
+                self._db.execute(
+                    'CREATE INDEX IF NOT EXISTS cache_accessed '
+                    'ON cache (accessed)'
+                )
+
+        return self._db
+
+    def close(self):
+        """
+        Close the connection to the database, which will be reopened if the
+        cache gets used again. Do this before forking, since sqlite
+        connections can't be shared with child processes.
+        """
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, key):
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                'SELECT value, created FROM cache WHERE key = ?', (key,),
+            ).fetchone()
+            now = time.time()
+
+            if row is not None and self.ttl is not None and (
+                row[1] < now - (self.ttl * 60 * 60)
+            ):
+                with db:
+                    db.execute('DELETE FROM cache WHERE key = ?', (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            with db:
+                db.execute(
+                    'UPDATE cache SET accessed = ? WHERE key = ?', (now, key),
+                )
+
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        with self._lock:
+            db = self._connect()
+            now = time.time()
+
+            with db:
+                db.execute(
+                    'INSERT OR REPLACE INTO cache '
+                    '(key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                    (key, value, now, now),
+                )
+
+                if self.max_entries is not None:
+                    db.execute(
+                        'DELETE FROM cache WHERE key IN ('
+                        'SELECT key FROM cache ORDER BY accessed DESC '
+                        'LIMIT -1 OFFSET ?'
+                        ')', (self.max_entries,),
+                    )
+
+                if self.max_bytes is not None:
+                    self._evict_bytes(db)
+
+    def _evict_bytes(self, db):
+        """
+        Delete the least recently used entries until the rest fit in
+        max_bytes.
+        """
+
+        # this would be one query with a window function, but those need
+        # sqlite 3.25, which is newer than a lot of pythons come with
+        excess = db.execute(
+            'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache'
+        ).fetchone()[0] - self.max_bytes
+
+        if excess <= 0:
+            return
+
+        doomed = []
+
+        for key, size in db.execute(
+            'SELECT key, LENGTH(value) FROM cache ORDER BY accessed, key'
+        ):
+            doomed.append((key,))
+            excess -= size
+
+            if excess <= 0:
+                break
+
+        db.executemany('DELETE FROM cache WHERE key = ?', doomed)
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute(
+                'SELECT COUNT(*) FROM cache'
+            ).fetchone()[0]
+
+    def size_in_bytes(self):
+        with self._lock:
+            return self._connect().execute(
+                'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache'
+            ).fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'bytes': self.size_in_bytes(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else None,
+        }
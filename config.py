@@ -10,13 +10,120 @@ DUCK_IMAGE_DIR = os.path.realpath(os.path.join(
 
 # image layout
 BASE_PADDING = 6
-ALIAS_FACTOR = 4
+TEXT_SIZE = 18  # in pixels
 GOOGLE_LOGO_PAD = 26  # the height of the google logo on street view renders
+ASSET_CACHE_SIZE = 32  # how many scaled duck sprites and fonts to keep around
 ICON_PREFIX = (
     'https://raw.githubusercontent.com/very-scary-scenario/duck/master'
     '/icons/'
 )
 
+# how to draw the map inset; 'local' to draw it ourselves over MAP_TILE_URL,
+# or 'google' to get it from the Static Maps API
+MAP_RENDERER = 'local'
+MAP_TILE_URL = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+MAP_ATTRIBUTION = '© OpenStreetMap contributors'
+MAP_MAX_ZOOM = 16
+MAP_TILE_CACHE_SIZE = 64  # how many decoded tiles to keep in memory
+
+# how frames get encoded for posting; 'PNG' or 'JPEG', which is all twitter
+# will take from us
+IMAGE_FORMAT = 'JPEG'
+IMAGE_QUALITY = 90  # for JPEG
+IMAGE_MIN_QUALITY = 50
+# in bytes; JPEG quality gets stepped down towards IMAGE_MIN_QUALITY until an
+# encoded frame fits in this. PNG is lossless, so it ignores this
+IMAGE_BUDGET = 1024 * 1024
+
+# -- NETWORK:
+
+HTTP_TIMEOUT = (5, 15)  # in seconds; to connect, and then between bytes
+HTTP_DEADLINE = 30  # in seconds; the longest we'll spend downloading an image
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 1  # in seconds; doubled on every retry
+HTTP_USER_AGENT = (
+    'duck/1.0 (+https://github.com/very-scary-scenario/duck)'
+)
+
+# -- CACHING:
+
+DIRECTIONS_CACHE_LOCATION = os.path.join(
+    os.path.dirname(__file__),
+    'directions-cache.sqlite3',
+)
+DIRECTIONS_CACHE_SIZE = 5000  # in routes
+DIRECTIONS_CACHE_TTL = None  # in hours; None to keep routes until evicted
+
+IMAGE_CACHE_LOCATION = os.path.join(
+    os.path.dirname(__file__),
+    'image-cache.sqlite3',
+)
+IMAGE_CACHE_SIZE = 256 * 1024 * 1024  # in bytes
+
+# how many decimal places to round positions to when asking for images of
+# them; 4 is about 10m, which is plenty close enough for a duck
+IMAGE_CACHE_PRECISION = 4
+
+# how many different directions we might point the street view camera in;
+# None to pick any heading at all (and rarely get the same image twice)
+STREETVIEW_HEADING_BUCKETS = 8
+
+# -- STORAGE:
+
+DUCK_STORAGE_LOCATION = os.path.join(
+    os.path.dirname(__file__),
+    'duck-storage.sqlite3',
+)
+
+# -- TIMELAPSES:
+
+TIMELAPSE_FRAMES = 240  # the most frames a journey's timelapse can have
+TIMELAPSE_FPS = 12
+# how many street view photos a timelapse is made from; each is shown for a
+# stretch of frames, so that a timelapse doesn't cost a download per frame
+TIMELAPSE_KEYFRAMES = 16
+TIMELAPSE_HOLD = 2  # in seconds; how long to linger on the final frame
+FFMPEG = 'ffmpeg'  # the ffmpeg to encode timelapses with
+
+# -- ROUTING:
+
+# in degrees; the size of the grid cells places are indexed by, which should
+# hold a handful of places each
+PLACE_GRID_SIZE = 0.25
+PLACE_GRID_MINIMUM = 2000  # with fewer places, it's quicker to measure to all
+
+# where new routes come from; 'google' or 'local'
+ROUTING_BACKEND = 'google'
+
+# the road graph the local routing backend uses, as made by routing.py
+ROAD_GRAPH_LOCATION = os.path.join(
+    os.path.dirname(__file__),
+    'road-graph.npz',
+)
+
+ROUTE_GRAPH_LOCATION = os.path.join(
+    os.path.dirname(__file__),
+    'route-graph.bin',
+)
+# how many nearby places to route to from each. this is also the most places
+# a duck will choose its next destination from, however experienced it gets,
+# so that every journey from a place can come from the graph
+ROUTE_GRAPH_NEIGHBOURS = 20
+
+# in km; how close to a place a duck has to be for us to consider it to be
+# setting off from there. any further and starting the precomputed route
+# from that place would visibly move the duck, so this is the same 'literally
+# the spot' radius that picking places uses
+ROUTE_GRAPH_SNAP_RADIUS = 0.2
+
+# in km; how far the most detailed simplification of a route we draw can
+# stray from it. each coarser level doubles it
+ROUTE_SIMPLIFY_TOLERANCE = 0.002
+
+# in pixels; how far the route drawn on the map inset can stray from the real
+# one
+MAP_SIMPLIFY_PIXELS = 0.5
+
 # -- PACING:
 
 # in km/h:
@@ -31,3 +138,13 @@ DELAY_VARIANCE = 1/2
 
 # how long to give people to vote, should be ten minutes or so
 DELAY_AUTOPLAY = 1/6
+
+# how many of a duck's most recent scenarios it won't encounter again
+SCENARIO_COOLDOWN = 3
+
+# how likely each scenario is to come up, relative to the others, by filename;
+# scenarios not listed here have a weight of 1
+SCENARIO_WEIGHTS = {}
+
+# how often `twitter.py --daemon` checks in, even if the duck isn't due yet
+POLL_INTERVAL = 1/60
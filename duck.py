@@ -1,28 +1,81 @@
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import os
+from io import BytesIO
+from itertools import accumulate
+import json
+from math import floor, log2
 import random
 
 from camel import Camel
-from dateutil.parser import parse as parse_date
-from django.contrib.gis.geos import LineString, Point
-import PIL
-import PIL.ImageDraw
-import PIL.ImageFont
-import polyline
 from pytz import utc
-import requests
 
 from config import (
-    IMAGE_SIZE, DUCK_IMAGE_DIR, BASE_SPEED, BASE_PADDING, ALIAS_FACTOR,
+    IMAGE_SIZE, BASE_SPEED, BASE_PADDING,
     GOOGLE_LOGO_PAD, ICON_PREFIX, DELAY_MINIMUM, DELAY_VARIANCE,
-    DELAY_AUTOPLAY,
+    DELAY_AUTOPLAY, SCENARIO_COOLDOWN, MAP_RENDERER, ROUTE_SIMPLIFY_TOLERANCE,
+    MAP_SIMPLIFY_PIXELS, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MIN_QUALITY,
+    IMAGE_BUDGET,
 )
-from google import streetview_url, static_map_url
-from route import _length_in_km, random_route_from
+import geo
+from route import _cumulative_lengths_in_km, random_route_from
 from scenario import (
-    Scenario, EXPERIENCE, SPEED, DISTANCE, MOTIVATION, registry,
+    Scenario, EXPERIENCE, SPEED, DISTANCE, MOTIVATION, catalog, registry,
 )
 
+# the version of the format dump_duck() writes
+SAVE_VERSION = 2
+
+# coordinates are saved as integers in units of this many degrees, which is
+# as precise as the polylines that routes come from
+SAVE_PRECISION = 1e5
+
+# for downloading the images that make up a frame alongside one another
+_fetch_pool = ThreadPoolExecutor(max_workers=2)
+
+IMAGE_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg'}
+
+PROGRESS_TEMPLATE = (
+    '{progress:.1f} / {total:.1f} km travelled\n'
+    'Speed: {speed} km/h\n'
+    'Motivation: {motivation}\n'
+    'Experience: {experience}'
+)
+
+
+def encode_image(
+    image, format=IMAGE_FORMAT, quality=IMAGE_QUALITY, budget=IMAGE_BUDGET,
+):
+    """
+    Encode image in memory, lowering the quality a step at a time until it
+    fits in budget bytes or we hit IMAGE_MIN_QUALITY. Return a filename with
+    the right extension alongside a file object of the encoded image.
+    """
+
+    if format not in IMAGE_EXTENSIONS:
+        raise ValueError('cannot encode images as {!r}'.format(format))
+
+    if format == 'JPEG':
+        image = image.convert('RGB')  # jpeg has no alpha channel
+
+    while True:
+        f = BytesIO()
+
+        if format == 'PNG':
+            # lossless, so there's no quality to step down
+            image.save(f, format=format, optimize=True)
+            break
+
+        image.save(f, format=format, quality=quality, optimize=True)
+
+        if f.tell() <= budget or quality <= IMAGE_MIN_QUALITY:
+            break
+
+        quality = max(IMAGE_MIN_QUALITY, quality - 10)
+
+    f.seek(0)
+    return 'duck.{}'.format(IMAGE_EXTENSIONS[format]), f
+
 
 def now():
     dt = datetime.utcnow()
@@ -30,80 +83,144 @@ def now():
 
 
 class Duck:
-    def __init__(self, route, experience=0):
+    def __init__(self, route, experience=0, clock=now, rng=random):
+        self.clock = clock
+        self.rng = rng
         self.route = route
+        self._cumulative = _cumulative_lengths_in_km(route)
+        self._simplified = {}  # by level of detail
         self.progress = 0
         self.speed = BASE_SPEED
         self.experience = experience
         self.motivation = 3 + int(experience/8)
         self.scenario = None
         self.last_scenario = None
+        self.recent_scenarios = []  # ids, oldest first
         self.success = None
-        self.next_active = now()
+        self.next_active = self.clock()
 
     def total_distance(self):
-        return _length_in_km(self.route)
+        return self._cumulative[-1]
+
+    def _locate(self):
+        """
+        Return the index of the first vertex Duck hasn't passed yet, and the
+        exact (lat, lon) point Duck has progressed to, or None if Duck hasn't
+        set off.
+        """
+
+        progress = min(self.progress, self.total_distance())
+
+        if progress <= 0:
+            return None
+
+        # the first vertex at or beyond our progress; the one before it is
+        # the last vertex we've passed
+        i = bisect_left(self._cumulative, progress)
+        start_km, end_km = self._cumulative[i-1], self._cumulative[i]
+        fraction = (progress - start_km) / (end_km - start_km)
+        (ax, ay), (bx, by) = self.route[i-1], self.route[i]
+
+        return i, (
+            ax + ((bx - ax) * fraction),
+            ay + ((by - ay) * fraction),
+        )
 
     def get_travel(self):
         """
-        Return a LineString of the route Duck has walked.
+        Return a list of the (lat, lon) points along the route that Duck has
+        walked, ending at the exact point Duck has progressed to.
         """
 
-        last_ls = None
+        located = self._locate()
 
-        for i in range(1, len(self.route)):
-            ls = LineString(self.route[:i+1], srid=4326)
-            km = _length_in_km(ls)
-            if km > self.progress and last_ls:
-                return last_ls
+        if located is None:
+            return None
 
-            if ls is not None:
-                last_ls = ls
+        i, point = located
+        return list(self.route[:i]) + [point]
 
-    def progress_summary(self):
+    def progress_fields(self):
         total = self.total_distance()
 
-        return (
-            '{progress:.1f} / {total:.1f} km travelled\n'
-            'Speed: {speed} km/h\n'
-            'Motivation: {motivation}\n'
-            'Experience: {experience}\n'
-            .format(
-                motivation=self.motivation,
-                total=total,
-                progress=min(self.progress, total),
-                experience=self.experience,
-                speed=self.speed,
-            )
-        ).strip()
+        return dict(
+            motivation=self.motivation,
+            total=total,
+            progress=min(self.progress, total),
+            experience=self.experience,
+            speed=self.speed,
+        )
+
+    def progress_summary(self):
+        return PROGRESS_TEMPLATE.format(**self.progress_fields())
 
     def get_destination(self):
         return self.route[-1]
 
     def get_position(self):
         """
-        Return the last point of Duck's travelled route.
+        Return the point Duck has reached along the route.
         """
 
         if self.success is True:
             return self.get_destination()
 
-        travel = self.get_travel()
+        located = self._locate()
 
-        if travel is None:
+        if located is None:
             return self.route[0]
         else:
-            return travel[-1]
+            return located[1]
+
+    def simplified_route(self, level=0):
+        """
+        Return the route simplified to within ROUTE_SIMPLIFY_TOLERANCE km of
+        itself, doubled for every level.
+
+        Only use this for drawing and saving the route; distances and
+        progress are measured along the real one.
+        """
+
+        if level not in self._simplified:
+            self._simplified[level] = [self.route[i] for i in geo.simplify(
+                self.route, ROUTE_SIMPLIFY_TOLERANCE * (2 ** level),
+            )]
+
+        return self._simplified[level]
+
+    def map_route(self):
+        """
+        Return the coarsest simplification of the route that still looks
+        like the real thing on the map inset.
+        """
+
+        coords = geo.as_coords(self.route)
+        (south, west), (north, east) = coords.min(axis=0), coords.max(axis=0)
+        extent = max(geo.distances(
+            [(south, west), (south, west)], [(north, west), (south, east)],
+        ))
+        tolerance = (extent / int(IMAGE_SIZE[1]/2)) * MAP_SIMPLIFY_PIXELS
+
+        if tolerance <= ROUTE_SIMPLIFY_TOLERANCE:
+            return self.simplified_route(0)
+
+        return self.simplified_route(
+            floor(log2(tolerance / ROUTE_SIMPLIFY_TOLERANCE)),
+        )
 
     def get_map_url(self):
+        import polyline
+
+        from google import round_coords, static_map_url
+
         marker_fmt = dict(
             icon_prefix=ICON_PREFIX,
             finish='{},{}'.format(*self.route[-1]),
-            duck='{},{}'.format(*self.get_position()),
+            duck=round_coords(*self.get_position()),
         )
         return static_map_url(
             path='color:0x6666DDCC|weight:3|enc:{}'.format(
-                polyline.encode(self.route)
+                polyline.encode(self.map_route())
             ),
             markers=[(
                 'anchor:bottomleft|icon:{icon_prefix}duck_end_icon.png|'
@@ -115,58 +232,59 @@ class Duck:
             size='{0}x{0}'.format(int(IMAGE_SIZE[1]/2)),
         )
 
-    def make_image(self):
-        image = PIL.Image.new(mode='RGBA', size=IMAGE_SIZE)
-        streetview_image = PIL.Image.open(requests.get(
-            streetview_url(*self.get_position()),
-            stream=True,
-        ).raw)
-        image.paste(streetview_image)
+    def make_map_image(self):
+        import PIL.Image
 
-        duck_image = PIL.Image.open(
-            os.path.join(DUCK_IMAGE_DIR, random.choice([
-                fn for fn in
-                os.listdir(DUCK_IMAGE_DIR)
-                if fn.endswith('.png') and not fn.startswith('.')
-            ]))
-        )
-        target_height = int(IMAGE_SIZE[1]*0.75)
-        target_width = int(
-            duck_image.width * (target_height / duck_image.height)
+        if MAP_RENDERER == 'local':
+            from minimap import render_map
+
+            return render_map(
+                self.map_route(), self.get_position(), int(IMAGE_SIZE[1]/2),
+            )
+
+        import network
+
+        return PIL.Image.open(network.fetch_cached(self.get_map_url()))
+
+    def make_image(self, streetview_url=None):
+        """
+        Return a frame showing where Duck is and how it's doing, over a
+        street view photo from streetview_url if given, or of where Duck is
+        if not.
+        """
+
+        # most uses of a duck never draw it, so we leave importing all of
+        # this until one does
+        import PIL.Image
+
+        from assets import random_duck_sprite
+        import google
+        import network
+        from overlay import render_text
+
+        # start both downloads straight away, and do everything that doesn't
+        # need them while we wait
+        streetview_future = _fetch_pool.submit(
+            network.fetch_cached,
+            streetview_url or google.streetview_url(*self.get_position()),
         )
-        duck_image = duck_image.resize((
-            target_width, target_height,
-        ), resample=PIL.Image.ANTIALIAS)
+        map_future = _fetch_pool.submit(self.make_map_image)
+
+        duck_image = random_duck_sprite()
+
+        text_image = render_text(PROGRESS_TEMPLATE, self.progress_fields())
+
+        image = PIL.Image.new(mode='RGBA', size=IMAGE_SIZE)
+        streetview_image = PIL.Image.open(streetview_future.result())
+        image.paste(streetview_image)
 
         image.paste(duck_image, (
             IMAGE_SIZE[0]-duck_image.width, IMAGE_SIZE[1]-duck_image.height
         ), duck_image)
 
-        text_image = PIL.Image.new(
-            mode='RGBA',
-            size=(IMAGE_SIZE[0]*ALIAS_FACTOR, IMAGE_SIZE[1]*ALIAS_FACTOR)
-        )
-        font = PIL.ImageFont.truetype(os.path.join(
-            os.path.dirname(__file__), 'fonts', 'lato', 'Lato-Bold.ttf',
-        ), int(text_image.height/70))
-        text_draw = PIL.ImageDraw.Draw(text_image)
-
-        text_draw.text((  # drop shadow
-            int(BASE_PADDING + font.size/9),
-            int(BASE_PADDING + font.size/9),
-        ), self.progress_summary(), (0, 0, 0), font=font)
-        text_draw.text((  # the text itself
-            BASE_PADDING, BASE_PADDING,
-        ), self.progress_summary(), (255, 255, 255), font=font)
-
-        text_image.resize((image.width, image.height),
-                          resample=PIL.Image.ANTIALIAS)
-
-        image.paste(text_image, (0, 0), text_image)
-
-        map_image = PIL.Image.open(requests.get(
-            self.get_map_url(), stream=True,
-        ).raw)
+        image.paste(text_image, (BASE_PADDING, BASE_PADDING), text_image)
+
+        map_image = map_future.result()
         image.paste(map_image, (
             BASE_PADDING, (image.height - GOOGLE_LOGO_PAD) - map_image.height,
         ))
@@ -174,7 +292,7 @@ class Duck:
         return image
 
     def make_progress(self):
-        hours = DELAY_MINIMUM + (random.random() * DELAY_VARIANCE)
+        hours = DELAY_MINIMUM + (self.rng.random() * DELAY_VARIANCE)
         self.delay_next_activity(hours)
         self.progress += (hours * self.speed)
 
@@ -197,8 +315,12 @@ class Duck:
             return
 
         self.last_scenario = self.scenario = Scenario.get_random(
-            self, avoid=self.last_scenario,
+            self, avoid=self.last_scenario, recent=self.recent_scenarios,
+            rng=self.rng,
         )
+        self.recent_scenarios = (
+            self.recent_scenarios + [self.scenario.id]
+        )[-SCENARIO_COOLDOWN:] if SCENARIO_COOLDOWN else []
         self.delay_next_activity(DELAY_AUTOPLAY)
 
         yield '{}\n\n{}'.format(self.scenario.prompt, '\n'.join((
@@ -241,16 +363,18 @@ class Duck:
         self.make_progress()
 
     def delay_next_activity(self, hours):
-        self.next_active = now() + timedelta(hours=hours)
+        self.next_active = self.clock() + timedelta(hours=hours)
 
     def make_successor(self):
+        from django.contrib.gis.geos import Point
+
         return Duck(random_route_from(
             Point(*self.get_position(), srid=4326),
             experience=self.experience,
             exclude=[
                 Point(*self.get_destination(), srid=4326),
             ],
-        ), experience=self.experience)
+        ), experience=self.experience, clock=self.clock, rng=self.rng)
 
     def advance(self, response=None):
         if self.success is not None:
@@ -260,17 +384,21 @@ class Duck:
             return self.set_off()
 
         elif self.scenario is None:
-            if self.next_active < now():
+            if self.next_active < self.clock():
                 return self.initiate_scenario()
         else:
             outcome = None
 
             if response is not None:
-                outcome = self.scenario.outcome_for(response.lower())
+                outcome = self.scenario.outcome_for(
+                    response.lower(), rng=self.rng,
+                )
 
-            elif self.next_active < now():
-                answer = random.choice(self.scenario.answers)
-                outcome = self.scenario.outcome_for(answer['answer'])
+            elif self.next_active < self.clock():
+                answer = self.rng.choice(self.scenario.answers)
+                outcome = self.scenario.outcome_for(
+                    answer['answer'], rng=self.rng,
+                )
 
             if outcome is None:
                 return
@@ -280,6 +408,8 @@ class Duck:
 
 @registry.dumper(Duck, 'duck', version=None)
 def _dump_duck(duck):
+    import polyline
+
     return {
         'route': polyline.encode(duck.route),
         'progress': duck.progress,
@@ -288,6 +418,7 @@ def _dump_duck(duck):
         'experience': duck.experience,
         'scenario': duck.scenario,
         'last_scenario': duck.last_scenario,
+        'recent_scenarios': duck.recent_scenarios,
         'success': duck.success,
         'next_active': duck.next_active.isoformat(),
     }
@@ -295,9 +426,10 @@ def _dump_duck(duck):
 
 @registry.loader('duck', version=None)
 def _load_duck(data, version):
-    duck = Duck(LineString(
-        polyline.decode(data.pop('route')), srid=4326,
-    ))
+    from dateutil.parser import parse as parse_date
+    import polyline
+
+    duck = Duck(polyline.decode(data.pop('route')))
 
     duck.next_active = parse_date(data.pop('next_active'))
 
@@ -307,7 +439,89 @@ def _load_duck(data, version):
     return duck
 
 
+def dump_duck(duck):
+    """
+    Return a duck as a compact JSON string, which load_duck() can read.
+
+    Dumping a duck with a Camel using registry will still give you YAML, if
+    you'd like something more readable.
+    """
+
+    # the whole route, not a simplification of it, since distances and
+    # progress are measured along it
+    coords = [round(c * SAVE_PRECISION) for point in duck.route for c in point]
+
+    return json.dumps({
+        'format': 'duck',
+        'version': SAVE_VERSION,
+        # each coordinate as an offset from the one before it, since those are
+        # much shorter numbers
+        'route': [b - a for a, b in zip([0, 0] + coords, coords)],
+        'progress': duck.progress,
+        'speed': duck.speed,
+        'motivation': duck.motivation,
+        'experience': duck.experience,
+        'scenario': duck.scenario and duck.scenario.id,
+        'last_scenario': duck.last_scenario and duck.last_scenario.id,
+        'recent_scenarios': duck.recent_scenarios,
+        'success': duck.success,
+        'next_active': duck.next_active.timestamp(),
+    }, separators=(',', ':'))
+
+
+def _load_duck_v1(data):
+    # version 1 didn't keep track of more than the last scenario
+    data['recent_scenarios'] = [
+        data['last_scenario'],
+    ] if data['last_scenario'] is not None else []
+    return _load_duck_v2(data)
+
+
+def _load_duck_v2(data):
+    offsets = data.pop('route')
+    duck = Duck(list(zip(
+        (c / SAVE_PRECISION for c in accumulate(offsets[0::2])),
+        (c / SAVE_PRECISION for c in accumulate(offsets[1::2])),
+    )))
+
+    duck.next_active = datetime.fromtimestamp(data.pop('next_active'), utc)
+
+    for k in ('scenario', 'last_scenario'):
+        scenario_id = data.pop(k)
+        setattr(duck, k, None if scenario_id is None else catalog[scenario_id])
+
+    for k, v in data.items():
+        setattr(duck, k, v)
+
+    return duck
+
+
+SAVE_LOADERS = {
+    1: _load_duck_v1,
+    2: _load_duck_v2,
+}
+
+
+def load_duck(string):
+    """
+    Load a duck saved by dump_duck(), or by dumping it as YAML with camel.
+    """
+
+    if not string.lstrip().startswith('{'):
+        return Camel([registry]).load(string)
+
+    data = json.loads(string)
+    version = data.pop('version')
+
+    if data.pop('format') != 'duck' or version not in SAVE_LOADERS:
+        raise ValueError('this is not a duck i know how to load')
+
+    return SAVE_LOADERS[version](data)
+
+
 def _sample_duck():
+    from django.contrib.gis.geos import Point
+
     return Duck(random_route_from(Point(
         53.095943, -2.469436,  # a nice spot in the middle of Valley Brook
         srid=4326,
@@ -317,13 +531,16 @@ def _sample_duck():
 if __name__ == '__main__':
     from sys import argv
 
-    camel = Camel([registry])
-
     try:
-        with open('cli-duck.yaml', 'r') as f:
-            duck = camel.load(f.read())
+        with open('cli-duck.json', 'r') as f:
+            duck = load_duck(f.read())
     except FileNotFoundError:
-        duck = _sample_duck()
+        try:
+            # from before we saved as json
+            with open('cli-duck.yaml', 'r') as f:
+                duck = load_duck(f.read())
+        except FileNotFoundError:
+            duck = _sample_duck()
 
     if duck.success is not None:
         print('your saved journey ended, starting a new one...')
@@ -355,5 +572,5 @@ if __name__ == '__main__':
         for string in advancement:
             print(string)
 
-    with open('cli-duck.yaml', 'w') as f:
-        f.write(camel.dump(duck))
+    with open('cli-duck.json', 'w') as f:
+        f.write(dump_duck(duck))
@@ -0,0 +1,101 @@
+"""
+Great-circle distances over arrays of (lat, lon) pairs, in km.
+"""
+
+import numpy
+
+# the mean radius of the earth, in km
+EARTH_RADIUS = 6371.0088
+
+
+def as_coords(coords):
+    """
+    Return coords, which can be anything shaped like a sequence of (lat, lon)
+    pairs, as an (n, 2) array.
+    """
+
+    if not isinstance(coords, numpy.ndarray):
+        coords = list(coords)
+
+    return numpy.asarray(coords, dtype=float).reshape(-1, 2)
+
+
+def distances(a, b):
+    """
+    Return the haversine distance between each pair in a and the
+    corresponding one in b. Either can be a single pair, which gets compared
+    to every pair in the other.
+    """
+
+    lat_a, lon_a = numpy.radians(as_coords(a)).T
+    lat_b, lon_b = numpy.radians(as_coords(b)).T
+
+    h = (
+        numpy.sin((lat_b - lat_a) / 2) ** 2 +
+        numpy.cos(lat_a) * numpy.cos(lat_b) *
+        numpy.sin((lon_b - lon_a) / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(h, 1)))
+
+
+def segment_lengths(coords):
+    coords = as_coords(coords)
+    return distances(coords[:-1], coords[1:])
+
+
+def cumulative_lengths(coords):
+    """
+    Return the distance from the start of coords to each of its points.
+    """
+
+    return numpy.concatenate(([0], numpy.cumsum(segment_lengths(coords))))
+
+
+def length(coords):
+    return float(segment_lengths(coords).sum())
+
+
+def simplify(coords, tolerance):
+    """
+    Return the indices of the points in coords that Douglas-Peucker keeps
+    when simplifying them to within tolerance km of the original line.
+    """
+
+    coords = as_coords(coords)
+
+    if len(coords) < 3:
+        return numpy.arange(len(coords))
+
+    # a flat projection around the middle of coords, in km, which is plenty
+    # accurate over the length of a route
+    xy = numpy.radians(coords) * EARTH_RADIUS
+    xy[:, 1] *= numpy.cos(numpy.radians(coords[:, 0].mean()))
+
+    keep = numpy.zeros(len(coords), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(coords) - 1)]
+
+    while stack:
+        start, end = stack.pop()
+
+        if end - start < 2:
+            continue
+
+        a, b = xy[start], xy[end]
+        offsets = xy[start+1:end] - a
+        ab = b - a
+        length_squared = ab @ ab
+
+        if length_squared > 0:
+            along = numpy.clip((offsets @ ab) / length_squared, 0, 1)
+            offsets = offsets - (along[:, None] * ab)
+
+        furthest = numpy.argmax(numpy.hypot(*offsets.T))
+
+        if numpy.hypot(*offsets[furthest]) > tolerance:
+            middle = start + 1 + furthest
+            keep[middle] = True
+            stack.extend(((start, middle), (middle, end)))
+
+    return numpy.flatnonzero(keep)
@@ -1,14 +1,29 @@
 from random import random
 from urllib.parse import urlencode
 
-import requests
-
-from config import IMAGE_SIZE
+from config import (
+    IMAGE_SIZE, IMAGE_CACHE_PRECISION, STREETVIEW_HEADING_BUCKETS,
+)
+from network import get
 from secrets import GOOGLE_API_KEY
 
 
+def round_coords(*coords):
+    return '{},{}'.format(*(
+        round(c, IMAGE_CACHE_PRECISION) for c in coords
+    ))
+
+
+def _random_heading():
+    if STREETVIEW_HEADING_BUCKETS is None:
+        return int(random() * 360)
+
+    bucket = int(random() * STREETVIEW_HEADING_BUCKETS)
+    return int(bucket * (360 / STREETVIEW_HEADING_BUCKETS))
+
+
 def directions(start, finish):
-    return requests.get(
+    return get(
         'https://maps.googleapis.com/maps/api/directions/json',
         params={
             'origin': start,
@@ -20,14 +35,16 @@ def directions(start, finish):
     ).json()
 
 
-def streetview_url(*coords):
+def streetview_url(*coords, heading=None):
     return (
         'https://maps.googleapis.com/maps/api/streetview?{}'.format(
             urlencode({
                 'size': '{}x{}'.format(*IMAGE_SIZE),
-                'location': '{},{}'.format(*coords),
+                'location': round_coords(*coords),
                 'fov': 90,
-                'heading': int(random() * 360),
+                'heading': (
+                    _random_heading() if heading is None else heading
+                ),
                 'pitch': 10,
                 'key': GOOGLE_API_KEY,
             })
@@ -0,0 +1,78 @@
+"""
+Report how long it takes to import each of our modules from cold, and which
+of the things they import are the most expensive, using python -X importtime.
+That only exists from python 3.7 on, so run this with one of those.
+
+    python importtime.py [module ...]
+"""
+
+from argparse import ArgumentParser
+import os
+import re
+import subprocess
+import sys
+
+MODULES = ['scenario', 'route', 'duck', 'twitter']
+LINE_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure(module):
+    """
+    Import module in a fresh interpreter, returning a list of (self µs,
+    cumulative µs, depth, name) for everything imported along the way.
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError('could not import {}:\n{}'.format(
+            module, result.stderr.strip().splitlines()[-1]))
+
+    return [
+        (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2,
+         m.group(4))
+        for m in (LINE_RE.match(line) for line in result.stderr.splitlines())
+        if m
+    ]
+
+
+def report(module, top=10):
+    rows = measure(module)
+    i, = [i for i, (_, _, depth, name) in enumerate(rows)
+          if depth == 0 and name == module]
+
+    print('{}: {:.1f} ms'.format(module, rows[i][1] / 1000))
+
+    # importtime lists everything module imported just before module itself,
+    # back until whatever was imported before it
+    direct = []
+
+    for _, cumulative, depth, name in reversed(rows[:i]):
+        if depth == 0:
+            break
+        elif depth == 1:
+            direct.append((cumulative, name))
+
+    direct.sort(reverse=True)
+
+    for cumulative, name in direct[:top]:
+        print('  {:>8.1f} ms  {}'.format(cumulative / 1000, name))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--top', type=int, default=10,
+                        help='how many imports to list for each module')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        try:
+            report(module, top=args.top)
+        except RuntimeError as e:
+            print(e)
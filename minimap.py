@@ -0,0 +1,137 @@
+"""
+Draw the map inset for a duck's route ourselves, on top of web map tiles,
+rather than asking the Static Maps API for one.
+"""
+
+from functools import lru_cache
+from math import floor
+import sys
+
+import numpy
+import PIL.Image
+import PIL.ImageDraw
+import requests
+
+from assets import get_font, get_icon
+from config import (
+    MAP_TILE_URL, MAP_TILE_CACHE_SIZE, MAP_MAX_ZOOM, MAP_ATTRIBUTION,
+    BASE_PADDING,
+)
+import geo
+import network
+
+TILE_SIZE = 256
+BACKGROUND = (230, 228, 224, 255)
+ROUTE_COLOUR = (0x66, 0x66, 0xDD, 0xCC)
+ROUTE_WIDTH = 3
+
+
+def _world_pixels(coords, zoom):
+    """
+    Return where (lat, lon) coords fall, in pixels, on a web mercator map of
+    the whole world at zoom.
+    """
+
+    lat, lon = numpy.radians(geo.as_coords(coords)).T
+    scale = TILE_SIZE * (2 ** zoom)
+
+    mercator = numpy.log(numpy.tan(lat) + (1 / numpy.cos(lat)))
+
+    return numpy.column_stack((
+        (lon + numpy.pi) / (2 * numpy.pi),
+        (1 - (mercator / numpy.pi)) / 2,
+    )) * scale
+
+
+def _fit_zoom(coords, size, padding):
+    """
+    Return the closest zoom at which coords fit in a square of size pixels,
+    with padding pixels to spare on each side.
+    """
+
+    extent = numpy.ptp(_world_pixels(coords, 0), axis=0).max()
+
+    for zoom in range(MAP_MAX_ZOOM, 0, -1):
+        if extent * (2 ** zoom) <= size - (2 * padding):
+            return zoom
+
+    return 0
+
+
+@lru_cache(maxsize=MAP_TILE_CACHE_SIZE)
+def _load_tile(zoom, x, y):
+    return PIL.Image.open(network.fetch_cached(
+        MAP_TILE_URL.format(z=zoom, x=x, y=y)
+    )).convert('RGBA')
+
+
+def _tile(zoom, x, y):
+    """
+    Return a map tile, or None if we can't get hold of it right now.
+    """
+
+    try:
+        return _load_tile(zoom, x, y)
+    except (requests.RequestException, OSError) as e:
+        # we'll just have to draw the route on a blank background
+        print('could not get map tile {}/{}/{}: {}'.format(zoom, x, y, e),
+              file=sys.stderr)
+        return None
+
+
+def render_map(route, position, size):
+    """
+    Return a square map of size pixels, showing route, where it ends and the
+    duck's position along it.
+    """
+
+    zoom = _fit_zoom(route, size, padding=32)
+    pixels = _world_pixels(route, zoom)
+    origin = ((pixels.min(axis=0) + pixels.max(axis=0)) / 2) - (size / 2)
+    origin_x, origin_y = (int(round(o)) for o in origin)
+
+    image = PIL.Image.new(mode='RGBA', size=(size, size), color=BACKGROUND)
+    tiles = 2 ** zoom
+
+    for tile_x in range(
+        floor(origin_x / TILE_SIZE), floor((origin_x + size) / TILE_SIZE) + 1,
+    ):
+        for tile_y in range(
+            max(0, floor(origin_y / TILE_SIZE)),
+            min(tiles, floor((origin_y + size) / TILE_SIZE) + 1),
+        ):
+            tile = _tile(zoom, tile_x % tiles, tile_y)
+
+            if tile is not None:
+                image.paste(tile, (
+                    (tile_x * TILE_SIZE) - origin_x,
+                    (tile_y * TILE_SIZE) - origin_y,
+                ))
+
+    overlay = PIL.Image.new(mode='RGBA', size=(size, size))
+    draw = PIL.ImageDraw.Draw(overlay)
+    draw.line(
+        [(x - origin_x, y - origin_y) for x, y in pixels.tolist()],
+        fill=ROUTE_COLOUR, width=ROUTE_WIDTH,
+    )
+
+    finish_x, finish_y = pixels[-1] - (origin_x, origin_y)
+    end_icon = get_icon('duck_end_icon.png')
+    overlay.paste(end_icon, (  # anchored at its bottom left
+        int(finish_x), int(finish_y) - end_icon.height,
+    ), end_icon)
+
+    duck_x, duck_y = _world_pixels([position], zoom)[0] - (origin_x, origin_y)
+    duck_icon = get_icon('duck_location_icon.png')
+    overlay.paste(duck_icon, (  # anchored at its centre
+        int(duck_x) - (duck_icon.width // 2),
+        int(duck_y) - (duck_icon.height // 2),
+    ), duck_icon)
+
+    if MAP_ATTRIBUTION:
+        font = get_font(9)
+        draw.text((
+            BASE_PADDING / 2, size - (BASE_PADDING / 2) - font.size,
+        ), MAP_ATTRIBUTION, (60, 60, 60), font=font)
+
+    return PIL.Image.alpha_composite(image, overlay)
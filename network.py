@@ -0,0 +1,138 @@
+"""
+Downloading things, politely: one shared session that says who we are,
+retries on the failures worth retrying, and a cache for images.
+"""
+
+from io import BytesIO
+from random import random
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import Cache
+from config import (
+    HTTP_TIMEOUT, HTTP_DEADLINE, HTTP_RETRIES, HTTP_BACKOFF, HTTP_USER_AGENT,
+    IMAGE_CACHE_LOCATION, IMAGE_CACHE_SIZE,
+)
+
+# responses that mean it's worth trying again in a bit
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+session = requests.Session()
+# some services, like openstreetmap's tile servers, turn away requests that
+# don't say what they're from
+session.headers['User-Agent'] = HTTP_USER_AGENT
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+image_cache = Cache(IMAGE_CACHE_LOCATION, max_bytes=IMAGE_CACHE_SIZE)
+
+
+def _retry_delay(attempt, response=None):
+    retry_after = (
+        response.headers.get('Retry-After', '') if response is not None
+        else ''
+    )
+
+    if retry_after.isdigit():
+        # however long we're asked to wait, we're not waiting longer than
+        # we'd spend on a whole download
+        return min(int(retry_after), HTTP_DEADLINE)
+
+    # exponential backoff with full jitter, so that we don't all come back at
+    # once
+    return HTTP_BACKOFF * (2 ** attempt) * random()
+
+
+def _give_up(attempt, delay, deadline):
+    return attempt == HTTP_RETRIES or time.monotonic() + delay > deadline
+
+
+def get(url, deadline=None, **kwargs):
+    """
+    Make a GET request with our shared session, retrying on connection
+    problems, server errors and rate limiting.
+
+    Everything, retries included, has to be done by deadline, a
+    time.monotonic() time that defaults to HTTP_DEADLINE seconds from now.
+    """
+
+    if deadline is None:
+        deadline = time.monotonic() + HTTP_DEADLINE
+
+    for attempt in range(HTTP_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+
+        if remaining <= 0:
+            raise requests.Timeout('gave up on {} after {} seconds'.format(
+                url, HTTP_DEADLINE))
+
+        try:
+            response = session.get(url, timeout=tuple(
+                min(t, remaining) for t in HTTP_TIMEOUT
+            ), **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            delay = _retry_delay(attempt)
+
+            if _give_up(attempt, delay, deadline):
+                raise
+        else:
+            delay = _retry_delay(attempt, response)
+
+            if (
+                response.status_code not in RETRY_STATUSES or
+                _give_up(attempt, delay, deadline)
+            ):
+                response.raise_for_status()
+                return response
+
+            response.close()
+
+        time.sleep(delay)
+
+
+def fetch(url):
+    """
+    Download url into an in-memory buffer, giving up if it takes longer than
+    HTTP_DEADLINE seconds in total.
+    """
+
+    deadline = time.monotonic() + HTTP_DEADLINE
+    buffer = BytesIO()
+
+    with get(url, deadline=deadline, stream=True) as response:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            if time.monotonic() > deadline:
+                raise requests.Timeout(
+                    'gave up downloading {} after {} seconds'.format(
+                        response.url, HTTP_DEADLINE))
+            buffer.write(chunk)
+
+    buffer.seek(0)
+    return buffer
+
+
+def fetch_cached(url):
+    """
+    Like fetch(), but served from our image cache if we've downloaded the
+    same thing before.
+    """
+
+    # the api key isn't part of what we're asking for
+    scheme, netloc, path, query, _ = urlsplit(url)
+    key = '{}://{}{}?{}'.format(scheme, netloc, path, urlencode([
+        (k, v) for k, v in parse_qsl(query) if k != 'key'
+    ]))
+
+    data = image_cache.get(key)
+
+    if data is None:
+        data = fetch(url).getvalue()
+        image_cache.set(key, data)
+
+    return BytesIO(data)
+
+
+if __name__ == '__main__':
+    print('image cache: {}'.format(image_cache.stats()))
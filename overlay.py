@@ -0,0 +1,105 @@
+"""
+The text in the corner of each frame, drawn at the size it's shown at.
+
+The labels are the same on every frame, so their masks are drawn once and
+kept; only the numbers that go between them get drawn fresh.
+"""
+
+from functools import lru_cache
+from math import ceil
+from string import Formatter
+
+import PIL.Image
+import PIL.ImageDraw
+
+from assets import get_font
+from config import TEXT_SIZE, ASSET_CACHE_SIZE
+
+SHADOW_OFFSET = max(1, round(TEXT_SIZE / 9))
+TEXT_COLOUR = (255, 255, 255, 255)
+SHADOW_COLOUR = (0, 0, 0, 255)
+
+
+def _width(font, text):
+    try:
+        return font.getlength(text)
+    except AttributeError:  # pillow before 8.0
+        return font.getsize(text)[0]
+
+
+@lru_cache(maxsize=8)
+def _parse(template):
+    """
+    Return template as a list of lines, each a list of (text, field, spec)
+    pieces, where only one of text and field is set.
+    """
+
+    lines = []
+
+    for line in template.split('\n'):
+        pieces = []
+
+        for text, field, spec, conversion in Formatter().parse(line):
+            if text:
+                pieces.append((text, None, None))
+            if field is not None:
+                pieces.append((None, field, spec))
+
+        lines.append(pieces)
+
+    return lines
+
+
+@lru_cache(maxsize=ASSET_CACHE_SIZE * 4)
+def _mask(text):
+    """
+    Return an antialiased mask of text, to stamp both the text and its
+    shadow with.
+    """
+
+    font = get_font(TEXT_SIZE)
+    mask = PIL.Image.new(mode='L', size=(
+        ceil(_width(font, text)), sum(font.getmetrics()),
+    ))
+    PIL.ImageDraw.Draw(mask).text((0, 0), text, 255, font=font)
+
+    return mask
+
+
+def render_text(template, fields):
+    """
+    Return template formatted with fields, with a drop shadow, on a
+    transparent image just big enough to hold it.
+    """
+
+    font = get_font(TEXT_SIZE)
+    line_height = sum(font.getmetrics())
+    placed = []
+
+    for y, pieces in enumerate(_parse(template)):
+        x = 0
+
+        for text, field, spec in pieces:
+            if text is None:
+                text = format(fields[field], spec)
+
+            placed.append(((round(x), y * line_height), _mask(text)))
+            x += _width(font, text)
+
+    overlay = PIL.Image.new(mode='RGBA', size=(
+        max(position[0] + mask.width for position, mask in placed) +
+        SHADOW_OFFSET,
+        max(position[1] + mask.height for position, mask in placed) +
+        SHADOW_OFFSET,
+    ))
+
+    # all the shadows first, so that none of them fall across text
+    for (x, y), mask in placed:
+        overlay.paste(
+            SHADOW_COLOUR, (x + SHADOW_OFFSET, y + SHADOW_OFFSET), mask,
+        )
+
+    for (x, y), mask in placed:
+        overlay.paste(TEXT_COLOUR, (x, y), mask)
+
+    return overlay
@@ -1,27 +1,43 @@
-from copy import copy
+from functools import lru_cache
 import os
 import random
 import re
+import sys
 
-from django.contrib.gis.geos import Point
-from django.contrib.gis.geos import LineString
-import polyline
+import numpy
 
-from google import directions
+from config import (
+    ROUTE_GRAPH_LOCATION, ROUTE_GRAPH_SNAP_RADIUS, ROUTE_GRAPH_NEIGHBOURS,
+    PLACE_GRID_SIZE, PLACE_GRID_MINIMUM,
+)
+import geo
+from route_graph import RouteGraph, places_digest
+from routing import directions_cache, get_router
 
 
 def _length_in_km(ls):
-    transformed_ls = copy(ls)
-    transformed_ls.transform(3857)
-    return transformed_ls.length/1000
+    return geo.length(ls)
+
+
+def _cumulative_lengths_in_km(ls):
+    """
+    Return a list of the distance, in km, from the start of ls to each of its
+    vertices.
+    """
+
+    return geo.cumulative_lengths(ls).tolist()
 
 
 def _distance_between(point_a, point_b):
     assert point_a.srid == point_b.srid
-    return _length_in_km(LineString([point_a, point_b], srid=point_a.srid))
+    return float(geo.distances(
+        (point_a.x, point_a.y), (point_b.x, point_b.y),
+    )[0])
 
 
 def get_places():
+    from django.contrib.gis.geos import Point
+
     with open(os.path.join(os.path.dirname(__file__), 'places.txt')) as f:
         return [
             {
@@ -40,59 +56,258 @@ def get_places():
         ]
 
 
-PLACES = get_places()
+class PlaceIndex:
+    """
+    The coordinates of a list of places in one array, so that we can measure
+    the distance to all of them in a single vectorised operation, bucketed
+    into a grid of PLACE_GRID_SIZE degree cells so that looking for the
+    nearest few only has to measure the distance to places close by.
+    """
+
+    def __init__(self, places, grid_size=PLACE_GRID_SIZE):
+        self.places = places
+        self.coords = geo.as_coords([
+            (p['point'].x, p['point'].y) for p in places
+        ])
+        self.grid_size = grid_size
+
+        cells = numpy.floor(self.coords / grid_size).astype(int)
+        order = numpy.lexsort((cells[:, 1], cells[:, 0]))
+        keys, starts, counts = numpy.unique(
+            cells[order], axis=0, return_index=True, return_counts=True,
+        )
+        self._cells = {
+            (i, j): order[start:start + count]
+            for (i, j), start, count in zip(keys.tolist(), starts, counts)
+        }
+        self._cell_bounds = (
+            (keys.min(axis=0), keys.max(axis=0)) if len(keys) else None
+        )
+        self._max_lat = float(numpy.abs(self.coords[:, 0]).max(initial=0))
+
+    def distances_from(self, point):
+        return geo.distances(self.coords, (point.x, point.y))
+
+    def _ring(self, centre, ring):
+        """
+        Return the indices of places in the square ring of cells ring cells
+        away from centre.
+        """
+
+        ci, cj = centre
+        cells = (
+            [(ci + di, cj + dj) for di in (-ring, ring)
+             for dj in range(-ring, ring + 1)] +
+            [(ci + di, cj + dj) for dj in (-ring, ring)
+             for di in range(-ring + 1, ring)]
+        ) if ring else [(ci, cj)]
+
+        found = [self._cells[c] for c in cells if c in self._cells]
+        return (
+            numpy.concatenate(found) if found
+            else numpy.empty(0, dtype=int)
+        )
+
+    def _allowed(self, candidates, distances, exclude, radius):
+        keep = distances >= radius
+
+        for excluded in exclude:
+            keep &= geo.distances(
+                self.coords[candidates], (excluded.x, excluded.y),
+            ) >= radius
+
+        return candidates[keep], distances[keep]
+
+    def _nearby(self, point, k, exclude, radius):
+        """
+        Return the indices of at least the k nearest allowed places to point,
+        and the distances to them, searching outwards a ring of cells at a
+        time.
+        """
+
+        centre = tuple(numpy.floor(
+            numpy.array((point.x, point.y)) / self.grid_size
+        ).astype(int).tolist())
+        (low_i, low_j), (high_i, high_j) = self._cell_bounds
+        last_ring = max(
+            abs(centre[0] - low_i), abs(centre[0] - high_i),
+            abs(centre[1] - low_j), abs(centre[1] - high_j),
+        )
+
+        # nothing outside the rings we've searched can be nearer than this
+        # many radians of longitude at the most polar latitude involved
+        cos_lat = numpy.cos(numpy.radians(max(self._max_lat, abs(point.x))))
+
+        candidates = []
+        distances = []
+
+        for ring in range(last_ring + 1):
+            found = self._ring(centre, ring)
+            found, found_distances = self._allowed(found, geo.distances(
+                self.coords[found], (point.x, point.y),
+            ), exclude, radius)
+            candidates.append(found)
+            distances.append(found_distances)
+
+            count = sum(len(c) for c in candidates)
+
+            if count >= k:
+                half_angle = numpy.radians(ring * self.grid_size) / 2
+                bound = 2 * geo.EARTH_RADIUS * numpy.arcsin(
+                    cos_lat * numpy.sin(half_angle),
+                )
+
+                if numpy.partition(
+                    numpy.concatenate(distances), k - 1,
+                )[k - 1] <= bound:
+                    break
+
+        return numpy.concatenate(candidates), numpy.concatenate(distances)
+
+    def nearest(self, point, k=None, exclude=(), radius=0.2):
+        """
+        Return the indices of the k nearest places to point, nearest first,
+        skipping any within radius km of point or of any point in exclude.
+        """
+
+        if (
+            k is None or self._cell_bounds is None or
+            len(self.places) < PLACE_GRID_MINIMUM
+        ):
+            candidates, distances = self._allowed(
+                numpy.arange(len(self.places)), self.distances_from(point),
+                exclude, radius,
+            )
+        else:
+            candidates, distances = self._nearby(point, k, exclude, radius)
+
+        order = numpy.lexsort((candidates, distances))
+
+        if k is not None:
+            order = order[:k]
+
+        return candidates[order]
+
+
+@lru_cache(maxsize=1)
+def get_place_index():
+    """
+    Return a PlaceIndex of every place in places.txt, which we only read the
+    first time we need it.
+    """
+
+    return PlaceIndex(get_places())
 
 
 def random_route():
-    starting_place = random.choice(PLACES)
+    starting_place = random.choice(get_place_index().places)
     return random_route_from(
         starting_place['point'], experience=0,
     )
 
 
+def destination_choices(experience):
+    """
+    Return how many of the nearest places a duck with this much experience
+    picks its next destination from.
+    """
+
+    # without experience, we don't have the confidence to attempt a journey
+    # any longer than this. past ROUTE_GRAPH_NEIGHBOURS, though, we'd be
+    # picking places we have no precomputed route to
+    return min(experience + 3, ROUTE_GRAPH_NEIGHBOURS)
+
+
+def _random_place_near(point, experience=None, exclude=()):
+    # anything within 200m of where we are is probably literally the spot
+    # we're starting from, and anything that close to an excluded point should
+    # not be allowed either
+    options = get_place_index().nearest(
+        point,
+        k=None if experience is None else destination_choices(experience),
+        exclude=exclude,
+    )
+
+    return random.choice(options)
+
+
 def random_point_near(point, experience=None, exclude=()):
-    annotated_places = sorted(({
-        **p,
-        'distance': _distance_between(point, p['point'])
-    } for p in PLACES), key=lambda p: p['distance'])
+    return get_place_index().places[_random_place_near(
+        point, experience=experience, exclude=exclude,
+    )]['point']
 
-    options = []
 
-    for place in annotated_places:
-        if (experience is not None) and (len(options) >= (experience + 3)):
-            # we don't have the confidence to attempt a journey this long
-            break
+def _route_between(start, finish):
+    """
+    Return a list of (lat, lon) pairs describing a route between two points,
+    from whichever routing backend we're configured to use.
+    """
 
-        if place['distance'] < 0.2:
-            # this is close enough that it's probably literally the spot we're
-            # starting from
-            continue
+    return get_router().route(start, finish)
+
+
+_route_graph = None
 
-        for excluded in exclude:
-            if _distance_between(excluded, place['point']) < 0.2:
-                # this is an excluded point, or close enough that we should
-                # not allow it
-                continue
 
-        options.append(place)
+def get_route_graph():
+    """
+    Return the precomputed RouteGraph, or None if there isn't one that matches
+    our current list of places.
+    """
 
-    return random.choice(options)['point']
+    global _route_graph
 
+    if _route_graph is None:
+        try:
+            _route_graph = RouteGraph(ROUTE_GRAPH_LOCATION)
+        except FileNotFoundError:
+            _route_graph = False
+        else:
+            if _route_graph.places_digest != places_digest(
+                get_place_index().places
+            ):
+                _route_graph = False
 
-def _googlify(point):
-    # take a point and return a string we can hand to google maps as a lat/lon
-    # search query
-    return '{},{}'.format(point.x, point.y)
+    return _route_graph or None
 
 
 def random_route_from(point, experience=None, exclude=()):
-    destination = random_point_near(point, experience=experience, exclude=())
-    route, = directions(_googlify(point), _googlify(destination))['routes']
-    return LineString(
-        polyline.decode(route['overview_polyline']['points']),
-        srid=4326,
+    from django.contrib.gis.geos import LineString
+
+    destination = _random_place_near(
+        point, experience=experience, exclude=exclude,
     )
+    place_index = get_place_index()
+    points = None
+
+    route_graph = get_route_graph()
+    if route_graph is not None:
+        origin = place_index.nearest(point, k=1, radius=0)[0]
+        if (
+            place_index.distances_from(point)[origin] <=
+            ROUTE_GRAPH_SNAP_RADIUS
+        ):
+            points = route_graph.route(origin, destination)
+
+            if points is None:
+                print('no precomputed route from {} to {}; route graph: {}'
+                      .format(place_index.places[origin]['name'],
+                              place_index.places[destination]['name'],
+                              route_graph.stats()),
+                      file=sys.stderr)
+
+    if points is None:
+        points = _route_between(
+            point, place_index.places[destination]['point'],
+        )
+
+    return LineString(points, srid=4326)
 
 
 if __name__ == '__main__':
     print('made a {} km route'.format(_length_in_km(random_route())))
+    print('directions cache: {}'.format(directions_cache.stats()))
+
+    route_graph = get_route_graph()
+    if route_graph is not None:
+        print('route graph: {}'.format(route_graph.stats()))
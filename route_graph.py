@@ -0,0 +1,202 @@
+"""
+Routes between every place and its nearest neighbours, precomputed into a
+single file that can be memory-mapped, so that starting a journey between two
+places doesn't need to ask anyone for directions.
+
+Run this module to (re)build that file.
+"""
+
+from hashlib import sha1
+import json
+import struct
+
+import numpy
+
+from config import ROUTE_GRAPH_LOCATION, ROUTE_GRAPH_NEIGHBOURS
+
+MAGIC = b'DUCKROUTES'
+VERSION = 1
+HEADER = struct.Struct('<{}sI'.format(len(MAGIC)))
+
+# coordinates are stored as integers, in units of 1e-5 degrees, which is
+# exactly the precision polylines are encoded at
+PRECISION = 1e5
+POINT_DTYPE = numpy.dtype('<i4')
+PAIR_DTYPE = numpy.dtype([
+    ('key', '<u8'),  # (origin index << 32) | destination index
+    ('start', '<u8'),
+    ('stop', '<u8'),
+    ('length', '<f8'),
+])
+
+
+def places_digest(places):
+    return sha1('\n'.join(
+        '{}/{},{}'.format(p['name'], p['lat'], p['lon']) for p in places
+    ).encode()).hexdigest()
+
+
+def _pair_key(origin, destination):
+    return (int(origin) << 32) | int(destination)
+
+
+def _align(offset):
+    return offset + (-offset % 8)
+
+
+def build(places, place_index, router, measure,
+          location=ROUTE_GRAPH_LOCATION, neighbours=ROUTE_GRAPH_NEIGHBOURS):
+    """
+    Route from each of places to the neighbours nearest to it in place_index
+    and write the results to location.
+
+    router should take two points and return a list of (lat, lon) pairs
+    describing a route between them, and measure should take such a list and
+    return its length in km.
+    """
+
+    pairs = []
+    routes = []
+    points_so_far = 0
+
+    for origin, place in enumerate(places):
+        for destination in place_index.nearest(place['point'], k=neighbours):
+            try:
+                points = router(place['point'], places[destination]['point'])
+            except ValueError:
+                # there's no route between these two; maybe there's a body of
+                # water in the way
+                print('could not route from {} to {}'.format(
+                    place['name'], places[destination]['name']))
+                continue
+
+            pairs.append((
+                _pair_key(origin, destination),
+                points_so_far,
+                points_so_far + len(points),
+                measure(points),
+            ))
+            routes.append(numpy.round(
+                numpy.asarray(points, dtype=float) * PRECISION
+            ).astype(POINT_DTYPE))
+            points_so_far += len(points)
+
+        print('routed from {} ({}/{})'.format(
+            place['name'], origin + 1, len(places)))
+
+    pair_array = numpy.array(sorted(pairs), dtype=PAIR_DTYPE)
+    point_array = (
+        numpy.concatenate(routes) if routes
+        else numpy.empty((0, 2), dtype=POINT_DTYPE)
+    )
+
+    header = {
+        'version': VERSION,
+        'places': places_digest(places),
+        'pairs': len(pair_array),
+        'points': len(point_array),
+    }
+    header_bytes = json.dumps(header).encode()
+    header['pairs_offset'] = _align(HEADER.size + len(header_bytes) + 128)
+    header['points_offset'] = _align(
+        header['pairs_offset'] + pair_array.nbytes
+    )
+    header_bytes = json.dumps(header).encode()
+
+    with open(location, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        f.seek(header['pairs_offset'])
+        f.write(pair_array.tobytes())
+        f.seek(header['points_offset'])
+        f.write(point_array.tobytes())
+
+
+class RouteGraph:
+    """
+    A memory-mapped view of a file written by build().
+    """
+
+    def __init__(self, location=ROUTE_GRAPH_LOCATION):
+        with open(location, 'rb') as f:
+            magic, header_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('{} is not a route graph'.format(location))
+            header = json.loads(f.read(header_length).decode())
+
+        if header['version'] != VERSION:
+            raise ValueError('{} is a route graph of an unknown version'
+                             .format(location))
+
+        self.places_digest = header['places']
+        self.pairs = numpy.memmap(
+            location, dtype=PAIR_DTYPE, mode='r',
+            offset=header['pairs_offset'], shape=(header['pairs'],),
+        ) if header['pairs'] else numpy.empty(0, dtype=PAIR_DTYPE)
+        self.points = numpy.memmap(
+            location, dtype=POINT_DTYPE, mode='r',
+            offset=header['points_offset'], shape=(header['points'], 2),
+        ) if header['points'] else numpy.empty((0, 2), dtype=POINT_DTYPE)
+
+        # how often route() has and hasn't had the route asked for
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def _find(self, origin, destination):
+        key = _pair_key(origin, destination)
+        i = numpy.searchsorted(self.pairs['key'], key)
+        if i < len(self.pairs) and self.pairs['key'][i] == key:
+            return self.pairs[i]
+
+    def destinations_from(self, origin):
+        """
+        Return the indices of every place we have a route to from the place
+        at index origin.
+        """
+
+        keys = self.pairs['key']
+        start, stop = numpy.searchsorted(keys, [
+            _pair_key(origin, 0), _pair_key(origin + 1, 0),
+        ])
+        return (keys[start:stop] & 0xffffffff).astype(int)
+
+    def route(self, origin, destination):
+        """
+        Return the route between the places at two indices as a list of
+        (lat, lon) pairs, or None if we don't have one.
+        """
+
+        pair = self._find(origin, destination)
+        if pair is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return [
+            (lat / PRECISION, lon / PRECISION)
+            for lat, lon in self.points[pair['start']:pair['stop']].tolist()
+        ]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'pairs': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else None,
+        }
+
+    def length(self, origin, destination):
+        pair = self._find(origin, destination)
+        if pair is not None:
+            return float(pair['length'])
+
+
+if __name__ == '__main__':
+    from route import get_place_index, _length_in_km, _route_between
+
+    place_index = get_place_index()
+    build(place_index.places, place_index, _route_between, _length_in_km)
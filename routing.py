@@ -0,0 +1,259 @@
+"""
+Things that can find a route between two points.
+
+Each has a route(start, finish) method that returns a list of (lat, lon)
+pairs, or raises ValueError if there isn't a route. GoogleRouter asks the
+Google Maps Directions API (remembering what it's told), and LocalRouter finds
+shortest paths over a road graph on disk, which you can make from an
+OpenStreetMap XML extract by running:
+
+    python routing.py some-extract.osm
+"""
+
+from functools import lru_cache
+from heapq import heappop, heappush
+import json
+from math import asin, cos, radians, sin, sqrt
+
+import numpy
+import polyline
+
+from cache import Cache
+from config import (
+    DIRECTIONS_CACHE_LOCATION, DIRECTIONS_CACHE_SIZE, DIRECTIONS_CACHE_TTL,
+    ROUTING_BACKEND, ROAD_GRAPH_LOCATION,
+)
+import geo
+
+# the roads a duck might walk along; we avoid highways, just like we ask google
+# to
+ROAD_TYPES = {
+    'trunk', 'primary', 'secondary', 'tertiary', 'unclassified',
+    'residential', 'living_street', 'service', 'road',
+    'trunk_link', 'primary_link', 'secondary_link', 'tertiary_link',
+}
+
+directions_cache = Cache(
+    DIRECTIONS_CACHE_LOCATION,
+    max_entries=DIRECTIONS_CACHE_SIZE,
+    ttl=DIRECTIONS_CACHE_TTL,
+)
+
+
+def _googlify(point):
+    # take a point and return a string we can hand to google maps as a lat/lon
+    # search query
+    return '{},{}'.format(point.x, point.y)
+
+
+class GoogleRouter:
+    def route(self, start, finish):
+        # polylines are only precise to five decimal places, so neither are
+        # we
+        key = '{:.5f},{:.5f}|{:.5f},{:.5f}'.format(
+            start.x, start.y, finish.x, finish.y,
+        )
+        cached = directions_cache.get(key)
+
+        if cached is not None:
+            return json.loads(cached)
+
+        # google pulls in requests and our api key, neither of which we need
+        # if the route is cached
+        from google import directions
+
+        route, = directions(_googlify(start), _googlify(finish))['routes']
+        points = polyline.decode(route['overview_polyline']['points'])
+        directions_cache.set(key, json.dumps(points))
+        return points
+
+
+class RoadGraph:
+    """
+    A road network as arrays: the position of every junction, and the edges
+    out of each one in compressed sparse row form, weighted by length in km.
+    """
+
+    def __init__(self, coords, indptr, indices, weights):
+        self.coords = coords
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def load(cls, location):
+        arrays = numpy.load(location)
+        return cls(
+            arrays['coords'], arrays['indptr'], arrays['indices'],
+            arrays['weights'],
+        )
+
+    def save(self, location):
+        with open(location, 'wb') as f:
+            numpy.savez(
+                f, coords=self.coords, indptr=self.indptr,
+                indices=self.indices, weights=self.weights,
+            )
+
+    def nearest_node(self, lat, lon):
+        return int(numpy.argmin(geo.distances(self.coords, (lat, lon))))
+
+    def shortest_path(self, source, target):
+        """
+        Return the list of nodes along the shortest path from source to
+        target, found with A*, or None if they aren't connected.
+        """
+
+        coords, indptr = self.coords, self.indptr
+        indices, weights = self.indices, self.weights
+        target_lat, target_lon = (radians(c) for c in coords[target].tolist())
+        cos_target_lat = cos(target_lat)
+
+        def remaining(node):
+            # straight-line distance is never more than the distance by road,
+            # which keeps A* honest. this only gets worked out for the nodes
+            # we actually reach, rather than the whole graph up front
+            lat, lon = (radians(c) for c in coords[node].tolist())
+            h = (
+                sin((target_lat - lat) / 2) ** 2 +
+                cos(lat) * cos_target_lat * sin((target_lon - lon) / 2) ** 2
+            )
+            return 2 * geo.EARTH_RADIUS * asin(sqrt(min(h, 1)))
+
+        best = {source: 0.0}
+        came_from = {source: None}
+        queue = [(remaining(source), 0.0, source)]
+
+        while queue:
+            _, distance, node = heappop(queue)
+
+            if distance > best[node]:
+                # we've already found a shorter way here, and expanded it
+                continue
+
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = came_from[node]
+                return path[::-1]
+
+            start, stop = indptr[node:node + 2].tolist()
+
+            for neighbour, weight in zip(
+                indices[start:stop].tolist(), weights[start:stop].tolist(),
+            ):
+                through = distance + weight
+
+                if through < best.get(neighbour, float('inf')):
+                    best[neighbour] = through
+                    came_from[neighbour] = node
+                    heappush(queue, (
+                        through + remaining(neighbour), through, neighbour,
+                    ))
+
+        return None
+
+    @classmethod
+    def from_osm(cls, filename):
+        """
+        Build a RoadGraph from the roads in an OpenStreetMap XML file.
+        """
+
+        from xml.etree.ElementTree import iterparse
+
+        positions = {}
+        ways = []
+        way_nodes = None
+        way_tags = None
+
+        for event, element in iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == 'way':
+                    way_nodes, way_tags = [], {}
+                continue
+
+            if element.tag == 'node':
+                positions[element.get('id')] = (
+                    float(element.get('lat')), float(element.get('lon')),
+                )
+            elif element.tag == 'nd' and way_nodes is not None:
+                way_nodes.append(element.get('ref'))
+            elif element.tag == 'tag' and way_tags is not None:
+                way_tags[element.get('k')] = element.get('v')
+            elif element.tag == 'way':
+                if way_tags.get('highway') in ROAD_TYPES:
+                    ways.append(way_nodes)
+                way_nodes = way_tags = None
+
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+
+        node_ids = sorted({
+            n for way in ways for n in way if n in positions
+        })
+        index = {n: i for i, n in enumerate(node_ids)}
+        coords = numpy.array([positions[n] for n in node_ids], dtype=float)
+
+        # ducks can walk both ways down a one-way street
+        edges = numpy.array([
+            (index[a], index[b])
+            for way in ways
+            for a, b in zip(way, way[1:])
+            if a in index and b in index
+        ], dtype=numpy.int64).reshape(-1, 2)
+        edges = numpy.concatenate((edges, edges[:, ::-1]))
+        edges = edges[numpy.lexsort((edges[:, 1], edges[:, 0]))]
+
+        return cls(
+            coords=coords,
+            indptr=numpy.concatenate(([0], numpy.cumsum(
+                numpy.bincount(edges[:, 0], minlength=len(coords))
+            ))).astype(numpy.int64),
+            indices=edges[:, 1].astype(numpy.int32),
+            weights=geo.distances(
+                coords[edges[:, 0]], coords[edges[:, 1]],
+            ).astype(numpy.float32),
+        )
+
+
+class LocalRouter:
+    def __init__(self, location=ROAD_GRAPH_LOCATION):
+        self.graph = RoadGraph.load(location)
+
+    def route(self, start, finish):
+        path = self.graph.shortest_path(
+            self.graph.nearest_node(start.x, start.y),
+            self.graph.nearest_node(finish.x, finish.y),
+        )
+
+        if path is None:
+            raise ValueError('there is no road between {} and {}'.format(
+                _googlify(start), _googlify(finish)))
+
+        # round to polyline precision, so this looks just like a route from
+        # google would
+        return [
+            (round(lat, 5), round(lon, 5))
+            for lat, lon in self.graph.coords[path].tolist()
+        ]
+
+
+ROUTERS = {
+    'google': GoogleRouter,
+    'local': LocalRouter,
+}
+
+
+@lru_cache(maxsize=1)
+def get_router():
+    return ROUTERS[ROUTING_BACKEND]()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    graph = RoadGraph.from_osm(argv[1])
+    graph.save(ROAD_GRAPH_LOCATION)
+    print('saved {} junctions and {} roads to {}'.format(
+        len(graph.coords), len(graph.indices) // 2, ROAD_GRAPH_LOCATION))
@@ -1,12 +1,20 @@
+import json
 import os
 import random
+import re
+from types import MappingProxyType
 
 from camel import CamelRegistry
-import regex as re
+
+from config import SCENARIO_WEIGHTS
 
 registry = CamelRegistry()
 
 SCENARIO_DIR = os.path.join(os.path.dirname(__file__), 'scenarios')
+CATALOG_LOCATION = os.path.join(
+    os.path.dirname(__file__), 'scenario-catalog.json',
+)
+CATALOG_VERSION = 1
 
 EXPERIENCE = 'exp'
 SPEED = 'speed'
@@ -21,103 +29,329 @@ EFFECTS = [
 ]
 
 
+def _freeze(thing):
+    if isinstance(thing, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in thing.items()})
+    elif isinstance(thing, (list, tuple)):
+        return tuple(_freeze(v) for v in thing)
+    else:
+        return thing
+
+
+def _make_effect(source):
+    kind = source.lstrip('-+').lower()
+
+    if kind not in EFFECTS:
+        raise RuntimeError(
+            '{!r} is not an effect i understand'.format(kind)
+        )
+
+    return {
+        'positive': source[0] == '+',
+        'multiplier': len(source) - len(kind),
+        'kind': kind,
+        'source': source,
+    }
+
+
+def parse_scenario(filename):
+    """
+    Parse and validate a scenario file, returning a dict of its prompt and
+    answers.
+    """
+
+    # we only need this when the compiled catalog is out of date
+    import regex as re
+
+    prompt = None
+    answers = []
+
+    with open(filename, 'r') as f:
+        lines = (
+            raw.strip().strip('\ufeff')
+            for raw in f.readlines() if raw.strip()
+        )
+
+        for line in lines:
+            answer_match = re.match(r'<(.*)>$', line)
+            outcome_match = re.match(r'(\d+) (.*?)(\W[+-]+[^ ]*)*$', line)
+
+            if line.lower() == '<scenario>':
+                continue
+            elif prompt is None:
+                prompt = line
+            elif answer_match:
+                answers.append({
+                    'answer': answer_match.group(1), 'outcomes': [],
+                })
+            elif not answers:
+                continue
+            elif outcome_match:
+                answers[-1]['outcomes'].append({
+                    'probability': int(outcome_match.group(1)),
+                    'flavour': outcome_match.group(2),
+                    'effects': [
+                        _make_effect(c.strip())
+                        for c in outcome_match.captures(3)
+                    ],
+                })
+            else:
+                raise RuntimeError('could not parse {!r} from {}'.format(
+                    line, filename))
+
+    if prompt is None:
+        raise RuntimeError('{} has no prompt'.format(filename))
+
+    if not answers:
+        raise RuntimeError('{} has no answers'.format(filename))
+
+    for answer in answers:
+        if sum(o['probability'] for o in answer['outcomes']) <= 0:
+            raise RuntimeError('{!r} in {} has no possible outcomes'.format(
+                answer['answer'], filename))
+
+    return {'prompt': prompt, 'answers': answers}
+
+
+class AliasTable:
+    """
+    Walker's alias method, for picking indices in proportion to a list of
+    weights in constant time, however many there are.
+    """
+
+    def __init__(self, weights):
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError('at least one weight must be positive')
+
+        n = len(weights)
+        scaled = [w * n / total for w in weights]
+        self.probabilities = [1.0] * n
+        self.aliases = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+
+        while small and large:
+            small_index, large_index = small.pop(), large.pop()
+            self.probabilities[small_index] = scaled[small_index]
+            self.aliases[small_index] = large_index
+            scaled[large_index] -= 1 - scaled[small_index]
+            (small if scaled[large_index] < 1 else large).append(large_index)
+
+        # anything left over is only off from 1 by rounding error
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def draw(self, rng=random):
+        column = rng.random() * len(self.probabilities)
+        i = int(column)
+        return i if (column - i) < self.probabilities[i] else self.aliases[i]
+
+
 class Scenario:
-    def __init__(self, filename):
-        self._filename = filename
-        self.prompt = None
-        self.answers = []
-
-        with open(filename, 'r') as f:
-            lines = (
-                l.strip().strip('\ufeff')
-                for l in f.readlines() if l.strip()
-            )
-
-            for line in lines:
-                answer_match = re.match(r'<(.*)>$', line)
-                outcome_match = re.match(r'(\d+) (.*?)(\W[+-]+[^ ]*)*$', line)
-
-                if line.lower() == '<scenario>':
-                    continue
-                elif self.prompt is None:
-                    self.prompt = line
-                elif answer_match:
-                    self.answers.append({
-                        'answer': answer_match.group(1), 'outcomes': [],
-                    })
-                elif not self.answers:
-                    continue
-                elif outcome_match:
-                    self.answers[-1]['outcomes'].append({
-                        'probability': int(outcome_match.group(1)),
-                        'flavour': outcome_match.group(2),
-                        'effects': [
-                            self._make_effect(c.strip())
-                            for c in outcome_match.captures(3)
-                        ],
-                    })
-                else:
-                    raise RuntimeError('could not parse {!r} from {}'.format(
-                        line, filename))
-
-    def _make_effect(self, source):
-        kind = source.lstrip('-+').lower()
-
-        if kind not in EFFECTS:
-            raise RuntimeError(
-                '{!r} is not an effect i understand'.format(kind)
-            )
-
-        return {
-            'positive': source[0] == '+',
-            'multiplier': len(source) - len(kind),
-            'kind': kind,
-            'source': source,
+    """
+    A parsed scenario. These are shared between every duck that encounters
+    them, so get them from the catalog rather than making your own.
+    """
+
+    def __init__(self, id, prompt, answers):
+        self.id = id
+        self.prompt = prompt
+        self.answers = _freeze(answers)
+        self._compile_matcher()
+        self._outcome_tables = {
+            answer['answer']: AliasTable([
+                o['probability'] for o in answer['outcomes']
+            ]) for answer in self.answers
         }
 
+    def _compile_matcher(self):
+        # where several answers could match at the same place, the longest
+        # should win, so that's the order we try them in
+        self._matchable_answers = sorted(
+            self.answers, key=lambda a: -len(a['answer']),
+        )
+        self._matcher = re.compile(r'(?<!\w)(?:{})(?!\w)'.format('|'.join(
+            '({})'.format(re.escape(a['answer']))
+            for a in self._matchable_answers
+        )), re.IGNORECASE)
+
+    def __repr__(self):
+        return '<Scenario {!r}>'.format(self.id)
+
     @classmethod
-    def get_random(cls, duck, avoid=None):
-        options = [
-            fn for fn in os.listdir(SCENARIO_DIR)
-            if (
-                True if avoid is None else
-                (fn != os.path.basename(avoid._filename))
-            ) and fn.endswith('.txt') and not fn.startswith('.')
-        ]
-        return cls(os.path.join(SCENARIO_DIR, random.choice(options)))
+    def from_file(cls, filename):
+        return cls(os.path.basename(filename), **parse_scenario(filename))
+
+    @classmethod
+    def get_random(cls, duck, avoid=None, recent=(), rng=random):
+        return catalog.random(avoid=avoid, recent=recent, rng=rng)
 
     def answer_for(self, response):
-        for answer in self.answers:
-            if answer['answer'].lower() in response.lower():
-                return answer
+        """
+        Return the answer that response mentions as a whole word or phrase,
+        ignoring case. If it mentions more than one, the one that comes first
+        wins.
+        """
+
+        match = self._matcher.search(response)
+
+        if match is not None:
+            return self._matchable_answers[match.lastindex - 1]
 
-    def outcome_for(self, response):
+    def answers_for(self, responses):
+        return [self.answer_for(response) for response in responses]
+
+    def outcome_for(self, response, rng=random):
         answer = self.answer_for(response)
         if answer is None:
             return
 
-        total_probability = sum((o['probability'] for o in answer['outcomes']))
-        seed = random.random() * total_probability
-        cumulative = 0
+        return answer['outcomes'][
+            self._outcome_tables[answer['answer']].draw(rng)
+        ]
+
+
+class ScenarioCatalog:
+    """
+    Every scenario in a directory, parsed once per process.
+
+    The parsed scenarios are also kept in a compiled catalog file, so that
+    only scenario files that have changed since it was written need to be
+    parsed again.
+    """
+
+    def __init__(self, directory=SCENARIO_DIR, location=CATALOG_LOCATION):
+        self.directory = directory
+        self.location = location
+        self._scenarios = None
+
+    def _fingerprints(self):
+        fingerprints = {}
+
+        for fn in sorted(os.listdir(self.directory)):
+            if fn.endswith('.txt') and not fn.startswith('.'):
+                stat = os.stat(os.path.join(self.directory, fn))
+                fingerprints[fn] = [stat.st_mtime_ns, stat.st_size]
+
+        return fingerprints
+
+    def _read_compiled(self):
+        try:
+            with open(self.location, 'r') as f:
+                compiled = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if compiled.get('version') != CATALOG_VERSION:
+            return {}
+
+        return compiled['scenarios']
+
+    def _write_compiled(self, scenarios):
+        temporary_location = '{}.tmp'.format(self.location)
+
+        try:
+            with open(temporary_location, 'w') as f:
+                json.dump({
+                    'version': CATALOG_VERSION, 'scenarios': scenarios,
+                }, f)
+            os.replace(temporary_location, self.location)
+        except OSError:
+            # we can always parse everything again next time
+            pass
+
+    def build(self):
+        """
+        Parse every scenario that has changed since the compiled catalog was
+        written, and update the compiled catalog to match.
+        """
 
-        for outcome in answer['outcomes']:
-            cumulative += outcome['probability']
-            if cumulative >= seed:
-                break
+        compiled = self._read_compiled()
+        scenarios = {}
 
-        return outcome
+        for fn, fingerprint in self._fingerprints().items():
+            entry = compiled.get(fn)
+
+            if entry is None or entry['fingerprint'] != fingerprint:
+                entry = {
+                    'fingerprint': fingerprint,
+                    **parse_scenario(os.path.join(self.directory, fn)),
+                }
+
+            scenarios[fn] = entry
+
+        if scenarios != compiled:
+            self._write_compiled(scenarios)
+
+        self._scenarios = {
+            fn: Scenario(fn, entry['prompt'], entry['answers'])
+            for fn, entry in scenarios.items()
+        }
+        self._ids = list(self._scenarios)
+        self._table = AliasTable([
+            SCENARIO_WEIGHTS.get(id, 1) for id in self._ids
+        ])
+
+    @property
+    def scenarios(self):
+        if self._scenarios is None:
+            self.build()
+        return self._scenarios
+
+    def __getitem__(self, id):
+        return self.scenarios[id]
+
+    def __iter__(self):
+        return iter(self.scenarios.values())
+
+    def __len__(self):
+        return len(self.scenarios)
+
+    def random(self, avoid=None, recent=(), rng=random):
+        """
+        Pick a scenario in proportion to SCENARIO_WEIGHTS, other than avoid or
+        any whose id is in recent.
+        """
+
+        scenarios = self.scenarios
+        excluded = set(recent)
+        if avoid is not None:
+            excluded.add(avoid.id)
+
+        allowed = [
+            id for id in self._ids
+            if id not in excluded and SCENARIO_WEIGHTS.get(id, 1) > 0
+        ]
+
+        if not allowed:
+            # we've been told to avoid everything, which we can't do
+            return scenarios[self._ids[self._table.draw(rng)]]
+
+        # the exclusions are usually a small fraction of the catalog, so we
+        # should rarely need more than a couple of draws
+        while True:
+            id = self._ids[self._table.draw(rng)]
+            if id not in excluded:
+                return scenarios[id]
+
+
+catalog = ScenarioCatalog()
 
 
 @registry.dumper(Scenario, 'scenario', version=None)
 def _dump_scenario(scenario):
     return {
-        'filename': scenario._filename,
+        'id': scenario.id,
     }
 
 
 @registry.loader('scenario', version=None)
 def _load_scenario(data, version):
-    return Scenario(data['filename'])
+    # older saves refer to scenarios by their full path
+    return catalog[os.path.basename(data.get('id') or data['filename'])]
 
 
 if __name__ == '__main__':
@@ -132,9 +366,5 @@ if __name__ == '__main__':
                 ]),
             ) for answer in scenario.answers])
         )
-        for scenario in [
-            Scenario(os.path.join(SCENARIO_DIR, fn))
-            for fn in os.listdir(SCENARIO_DIR)
-            if fn.endswith('.txt') and not fn.startswith('.')
-        ]
+        for scenario in catalog
     ]))
@@ -0,0 +1,192 @@
+"""
+Play lots of journeys as quickly as possible, with nobody voting, to see how
+the numbers in config.py and the scenario probabilities play out.
+
+Journeys are routed using only the precomputed route graph, so build that
+first by running route_graph.py.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import json
+import random
+from statistics import mean, median
+
+from django.contrib.gis.geos import Point
+from pytz import utc
+
+from duck import Duck
+from route import destination_choices, get_place_index, get_route_graph
+
+# the most ticks we'll let a single journey take before declaring that the
+# duck is lost forever
+MAX_TICKS = 10000
+
+
+class SimulatedClock:
+    """
+    A clock for a Duck that only moves when we move it.
+    """
+
+    def __init__(self, time):
+        self.time = time
+
+    def __call__(self):
+        return self.time
+
+
+def _offline_route(graph, origin, rng, experience, exclude=()):
+    """
+    Pick a destination near the place at index origin the same way
+    random_route_from does, and return the route there along with whether
+    we had to settle for another destination because the graph doesn't have
+    a route to it.
+    """
+
+    place_index = get_place_index()
+    destination = rng.choice(place_index.nearest(
+        place_index.places[origin]['point'],
+        k=destination_choices(experience), exclude=exclude,
+    ).tolist())
+    points = graph.route(origin, destination)
+
+    if points is not None:
+        return points, False
+
+    # the live game would ask a router; the best we can do offline is the
+    # nearest destination we do have, and say so
+    reachable = graph.destinations_from(origin)
+    if not len(reachable):
+        raise RuntimeError('the route graph has no routes from {}'.format(
+            place_index.places[origin]['name']))
+
+    distances = place_index.distances_from(
+        place_index.places[destination]['point'],
+    )[reachable]
+    return graph.route(origin, int(reachable[distances.argmin()])), True
+
+
+def simulate_career(seed, journeys):
+    """
+    Play journeys consecutive journeys with one duck, returning a list of
+    stats about each of them.
+    """
+
+    rng = random.Random(seed)
+    clock = SimulatedClock(datetime(2018, 1, 26, tzinfo=utc))
+    graph = get_route_graph()
+    if graph is None:
+        raise RuntimeError('simulation needs an up-to-date route graph')
+
+    origin = rng.choice([i for i in range(len(get_place_index().places))
+                         if len(graph.destinations_from(i))])
+    points, clamped = _offline_route(graph, origin, rng, experience=0)
+    duck = Duck(points, clock=clock, rng=rng)
+    results = []
+
+    for journey in range(journeys):
+        started = clock.time
+        scenarios = 0
+
+        for tick in range(MAX_TICKS):
+            if duck.success is not None:
+                break
+
+            clock.time = max(clock.time, duck.next_active) + timedelta(
+                seconds=1,
+            )
+            had_scenario = duck.scenario is not None
+            advancement = duck.advance()
+
+            if advancement is not None:
+                for string in advancement:
+                    pass
+
+            if duck.scenario is not None and not had_scenario:
+                scenarios += 1
+
+        results.append({
+            'journey': journey,
+            'distance': duck.total_distance(),
+            'progress': min(duck.progress, duck.total_distance()),
+            'hours': (clock.time - started).total_seconds() / (60 * 60),
+            'scenarios': scenarios,
+            'success': duck.success,
+            'experience': duck.experience,
+            'clamped': clamped,
+        })
+
+        # the graph only has routes from places, so set off again from
+        # whichever place is nearest to where we stopped
+        origin = get_place_index().nearest(
+            Point(*duck.get_position(), srid=4326), k=1, radius=0,
+        )[0]
+        points, clamped = _offline_route(
+            graph, origin, rng, experience=duck.experience,
+            exclude=[Point(*duck.get_destination(), srid=4326)],
+        )
+        duck = Duck(
+            points, experience=duck.experience, clock=clock, rng=rng,
+        )
+
+    return results
+
+
+def summarise(careers):
+    journeys = [j for career in careers for j in career]
+    finished = [j for j in journeys if j['success'] is not None]
+
+    return {
+        'careers': len(careers),
+        'journeys': len(journeys),
+        'unfinished': len(journeys) - len(finished),
+        'give_up_rate': (
+            len([j for j in finished if j['success'] is False]) /
+            len(finished)
+        ) if finished else None,
+        'distance_km': {
+            'mean': mean(j['distance'] for j in journeys),
+            'median': median(j['distance'] for j in journeys),
+        },
+        'hours': {
+            'mean': mean(j['hours'] for j in journeys),
+            'median': median(j['hours'] for j in journeys),
+        },
+        'scenarios_per_journey': mean(j['scenarios'] for j in journeys),
+        # how many journeys went somewhere other than where a real duck
+        # would have, because the route graph didn't have the route; if this
+        # isn't close to 0, the distances and hours above are off
+        'clamped_rate': mean(j['clamped'] for j in journeys),
+        # the mean experience a duck has after each of its journeys
+        'experience_curve': [
+            mean(career[i]['experience'] for career in careers)
+            for i in range(min(len(career) for career in careers))
+        ],
+    }
+
+
+def simulate(careers, journeys, seed=None, workers=None):
+    seeds = random.Random(seed).sample(range(2 ** 32), careers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return summarise(list(executor.map(
+            simulate_career, seeds, [journeys] * careers,
+            chunksize=max(1, careers // 64),
+        )))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--careers', type=int, default=1000,
+                        help='how many ducks to simulate')
+    parser.add_argument('--journeys', type=int, default=100,
+                        help='how many journeys each duck should go on')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='how many processes to simulate in')
+    args = parser.parse_args()
+
+    print(json.dumps(simulate(
+        args.careers, args.journeys, seed=args.seed, workers=args.workers,
+    ), indent=2))
@@ -0,0 +1,123 @@
+import sqlite3
+
+
+class DuckStorage:
+    """
+    Every journey's saved state, kept in an SQLite database along with a
+    pointer to the one that's currently in progress.
+
+    States are stored as whatever text they are handed over as; this doesn't
+    know how to serialise a Duck.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.location)
+            with self._db:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS journeys ('
+                    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'started TEXT NOT NULL, '
+                    'updated TEXT NOT NULL, '
+                    'success INTEGER, '
+                    'state TEXT NOT NULL'
+                    ')'
+                )
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS pointers ('
+                    'name TEXT PRIMARY KEY, '
+                    'journey INTEGER NOT NULL REFERENCES journeys (id)'
+                    ')'
+                )
+
+        return self._db
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM journeys'
+        ).fetchone()[0]
+
+    def current(self):
+        """
+        Return the id and state of the most recent journey, or (None, None)
+        if there isn't one.
+        """
+
+        row = self._connect().execute(
+            'SELECT journeys.id, journeys.state FROM pointers '
+            'JOIN journeys ON journeys.id = pointers.journey '
+            'WHERE pointers.name = ?', ('current',),
+        ).fetchone()
+
+        return row if row is not None else (None, None)
+
+    def load(self, journey):
+        row = self._connect().execute(
+            'SELECT state FROM journeys WHERE id = ?', (journey,),
+        ).fetchone()
+
+        if row is None:
+            raise KeyError(journey)
+
+        return row[0]
+
+    def save(self, state, timestamp, success=None, journey=None):
+        """
+        Save the state of a journey, all at once or not at all, and return
+        its id. If journey is None, start a new one and make it current.
+        """
+
+        db = self._connect()
+
+        with db:
+            if journey is None:
+                journey = db.execute(
+                    'INSERT INTO journeys (started, updated, success, state) '
+                    'VALUES (?, ?, ?, ?)',
+                    (timestamp, timestamp, success, state),
+                ).lastrowid
+                db.execute(
+                    'INSERT OR REPLACE INTO pointers (name, journey) '
+                    'VALUES (?, ?)', ('current', journey),
+                )
+            else:
+                db.execute(
+                    'UPDATE journeys SET updated = ?, success = ?, state = ? '
+                    'WHERE id = ?', (timestamp, success, state, journey),
+                )
+
+        return journey
+
+    def journeys(self, success=..., limit=None):
+        """
+        Return the id, start time, last update time and success of past
+        journeys, most recent first, without loading their states.
+
+        Pass success to only include journeys that ended that way (None for
+        ones that haven't ended).
+        """
+
+        query = 'SELECT id, started, updated, success FROM journeys'
+        params = []
+
+        if success is None:
+            query += ' WHERE success IS NULL'
+        elif success is not ...:
+            query += ' WHERE success = ?'
+            params.append(success)
+
+        query += ' ORDER BY id DESC'
+
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        return [
+            (id, started, updated, None if success is None else bool(success))
+            for id, started, updated, success in
+            self._connect().execute(query, params)
+        ]
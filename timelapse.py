@@ -0,0 +1,224 @@
+"""
+Render a finished journey as an animation of the duck making its way along
+its route, frame by frame, straight into ffmpeg.
+
+    python timelapse.py --output recap.mp4
+    python timelapse.py 12 --output journey-12.gif
+
+Street view photos are only taken at TIMELAPSE_KEYFRAMES points along the
+route, each one standing behind the frames around it, and everything comes
+through the image cache, so rendering the same journey again costs nothing.
+"""
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+import subprocess
+
+from config import (
+    IMAGE_SIZE, DUCK_STORAGE_LOCATION, TIMELAPSE_FRAMES, TIMELAPSE_FPS,
+    TIMELAPSE_KEYFRAMES, TIMELAPSE_HOLD, FFMPEG,
+)
+from duck import load_duck
+import google
+import network
+from storage import DuckStorage
+
+# what to tell ffmpeg to do for each kind of file it can write
+ENCODER_ARGS = {
+    '.mp4': ['-c:v', 'libx264', '-pix_fmt', 'yuv420p'],
+    # a palette per frame, since a palette for the whole thing would mean
+    # ffmpeg holding on to every frame until it had seen them all
+    '.gif': [
+        '-vf', 'split[a][b];[a]palettegen=stats_mode=single[p];'
+        '[b][p]paletteuse=new=1',
+    ],
+    '.webp': ['-c:v', 'libwebp', '-loop', '0', '-quality', '80'],
+}
+
+# the saved state of the duck each worker process is drawing, the duck
+# itself, and how its journey ended
+_state = None
+_duck = None
+_success = None
+
+
+def _render_frame(state, progress, last, seed, streetview_url):
+    """
+    Return the raw RGB pixels of the frame where the duck saved as state has
+    got progress km along its route, in front of the photo at
+    streetview_url.
+    """
+
+    global _state, _duck, _success
+
+    # loaded on each worker's first frame, since pools can't be given an
+    # initializer before python 3.7
+    if state != _state:
+        _state, _duck = state, load_duck(state)
+        _success = _duck.success
+
+    _duck.progress = progress
+    _duck.success = _success if last else None
+
+    # the same sprite on every frame
+    random.seed(seed)
+
+    return _duck.make_image(streetview_url).convert('RGB').tobytes()
+
+
+def frame_progress(total_distance, frames):
+    """
+    Return how far along the route the duck is in each of frames frames.
+    """
+
+    if frames < 2:
+        return [total_distance]
+
+    return [total_distance * (i / (frames - 1)) for i in range(frames)]
+
+
+def streetview_urls(duck, keyframes, seed):
+    """
+    Return the url of a street view photo at each of keyframes points evenly
+    spaced along the part of duck's route it has travelled, having made sure
+    they're all in the image cache.
+    """
+
+    heading = random.Random(seed).randrange(360)
+    progress, success = duck.progress, duck.success
+    urls = []
+
+    for keyframe in frame_progress(
+        min(duck.progress, duck.total_distance()), keyframes,
+    ):
+        duck.progress, duck.success = keyframe, None
+        urls.append(google.streetview_url(
+            *duck.get_position(), heading=heading,
+        ))
+
+        # now, rather than in every worker that needs it at once
+        network.fetch_cached(urls[-1])
+
+    duck.progress, duck.success = progress, success
+    return urls
+
+
+def render_frames(
+    state, frames=TIMELAPSE_FRAMES, keyframes=TIMELAPSE_KEYFRAMES, seed=0,
+    workers=None,
+):
+    """
+    Yield the raw RGB pixels of each frame of the journey whose saved state
+    is state, in order.
+
+    Frames are rendered across a pool of processes, but only a couple per
+    process are ever waiting to be used, so this takes the same memory
+    however long the journey is.
+    """
+
+    duck = load_duck(state)
+    positions = frame_progress(
+        min(duck.progress, duck.total_distance()), frames,
+    )
+    keyframes = max(1, min(keyframes, frames))
+    urls = streetview_urls(duck, keyframes, seed)
+    workers = workers or os.cpu_count() or 1
+
+    # the workers are forked from us, and mustn't inherit our connection to
+    # the image cache
+    network.image_cache.close()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        for i, progress in enumerate(positions):
+            # the keyframe nearest to this frame
+            keyframe = round(i * (keyframes - 1) / max(1, frames - 1))
+            pending.append(executor.submit(
+                _render_frame, state, progress, i == len(positions) - 1,
+                seed, urls[keyframe],
+            ))
+
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def timelapse(
+    state, output, frames=TIMELAPSE_FRAMES, keyframes=TIMELAPSE_KEYFRAMES,
+    fps=TIMELAPSE_FPS, seed=0, workers=None,
+):
+    """
+    Write a timelapse of the journey whose saved state is state to output,
+    which can be an .mp4, .gif or .webp.
+    """
+
+    extension = os.path.splitext(output)[1].lower()
+
+    if extension not in ENCODER_ARGS:
+        raise ValueError('cannot write a timelapse to {}'.format(output))
+
+    encoder = subprocess.Popen([
+        FFMPEG, '-loglevel', 'error', '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-s', '{}x{}'.format(*IMAGE_SIZE), '-r', str(fps), '-i', '-',
+        *ENCODER_ARGS[extension], output,
+    ], stdin=subprocess.PIPE)
+
+    try:
+        frame = None
+
+        for frame in render_frames(state, frames, keyframes, seed, workers):
+            encoder.stdin.write(frame)
+
+        for hold in range(int(TIMELAPSE_HOLD * fps)):
+            encoder.stdin.write(frame)
+    finally:
+        encoder.stdin.close()
+
+    if encoder.wait() != 0:
+        raise RuntimeError('ffmpeg could not write {}'.format(output))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('journey', type=int, nargs='?', default=None,
+                        help='the id of the journey; the latest finished one '
+                        'if not given')
+    parser.add_argument('--output', default='timelapse.mp4',
+                        help='an .mp4, .gif or .webp to write to')
+    parser.add_argument('--frames', type=int, default=TIMELAPSE_FRAMES)
+    parser.add_argument('--keyframes', type=int, default=TIMELAPSE_KEYFRAMES,
+                        help='how many street view photos to use')
+    parser.add_argument('--fps', type=int, default=TIMELAPSE_FPS)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='how many processes to render in')
+    args = parser.parse_args()
+
+    storage = DuckStorage(DUCK_STORAGE_LOCATION)
+    journey = args.journey
+
+    if journey is None:
+        finished = [
+            id for id, started, updated, success in storage.journeys()
+            if success is not None
+        ]
+
+        if not finished:
+            raise SystemExit('no journey has finished yet')
+
+        journey = finished[0]
+
+    timelapse(
+        storage.load(journey), args.output, frames=args.frames,
+        keyframes=args.keyframes, fps=args.fps, seed=journey,
+        workers=args.workers,
+    )
+    print('wrote journey {} to {}'.format(journey, args.output))
+    # only what this process fetched; the workers keep their own counts
+    print('image cache: {}'.format(network.image_cache.stats()))
@@ -1,45 +1,69 @@
-from collections import Counter
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import os
+import signal
+import traceback
 
-from camel import Camel
 import tweepy
 
-from duck import now, registry, _sample_duck
+import assets
+from config import POLL_INTERVAL, DUCK_STORAGE_LOCATION, IMAGE_FORMAT
+from duck import (
+    IMAGE_EXTENSIONS, now, dump_duck, encode_image, load_duck, _sample_duck,
+)
+import network
 from secrets import TWITTER
+from storage import DuckStorage
+from votes import VoteCollector
 
+# where ducks used to be kept, one yaml file per journey
 DUCK_DIR = os.path.join(
     os.path.dirname(__file__),
     'duck-storage',
 )
-if not os.path.exists(DUCK_DIR):
-    os.mkdir(DUCK_DIR)
 
-DUCK_IMAGE_LOCATION = os.path.join(
-    os.path.dirname(__file__),
-    'duck.png',
-)
+# find out now, rather than when we come to post a picture
+if IMAGE_FORMAT not in IMAGE_EXTENSIONS:
+    raise ValueError('twitter will not take images as {!r}'.format(
+        IMAGE_FORMAT))
 
-camel = Camel([registry])
+storage = DuckStorage(DUCK_STORAGE_LOCATION)
+votes = VoteCollector(DUCK_STORAGE_LOCATION)
 
 auth = tweepy.OAuthHandler(TWITTER['consumer_key'], TWITTER['consumer_secret'])
 auth.set_access_token(TWITTER['access_token'], TWITTER['access_token_secret'])
 twitter = tweepy.API(auth)
 
 
-def get_duck():
-    duck_filenames = [
-        fn for fn in os.listdir(DUCK_DIR)
-        if fn.endswith('.yaml') and not fn.startswith('.')
-    ]
+def _import_duck_dir():
+    """
+    Move journeys saved by older versions into storage, oldest first, so that
+    the latest one becomes current.
+    """
+
+    if len(storage) or not os.path.isdir(DUCK_DIR):
+        return
 
-    if duck_filenames:
-        latest_duck_filename = sorted(duck_filenames)[-1]
+    for fn in sorted(os.listdir(DUCK_DIR)):
+        if fn.endswith('.yaml') and not fn.startswith('.'):
+            with open(os.path.join(DUCK_DIR, fn)) as f:
+                state = f.read()
 
-        with open(os.path.join(DUCK_DIR, latest_duck_filename)) as f:
-            latest_duck = camel.load(f.read())
+            storage.save(
+                state, timestamp=fn[:-len('.yaml')],
+                success=load_duck(state).success,
+            )
+
+
+def get_duck():
+    _import_duck_dir()
+    journey, state = storage.current()
+
+    if state is not None:
+        latest_duck = load_duck(state)
 
         if latest_duck.success is None:
-            return (latest_duck, latest_duck_filename)
+            return (latest_duck, journey)
         else:
             # start from where we finished
             return (latest_duck.make_successor(), None)
@@ -59,47 +83,44 @@ def get_latest_duck_tweet():
         return tweets[0]
 
 
-if __name__ == '__main__':
-    duck, filename = get_duck()
+def tally_votes(duck):
+    """
+    Collect any new votes on the scenario duck is in and, if voting has
+    closed, return the most popular response to it. Also return the id of
+    the tweet that asked the question.
+    """
 
-    latest_tweet = None
+    if duck.scenario is None:
+        return None, None
+
+    if votes.prompt is None:
+        # we were asking this before we kept track of what we asked
+        latest_tweet = get_latest_duck_tweet()
+        if latest_tweet is None:
+            return None, None
+        votes.open(latest_tweet.id)
+
+    votes.collect(twitter, duck.scenario)
 
     # respecting next_active here makes sense even if similar logic is already
     # in Duck, since on the CLI there's no reason to force the player to wait,
     # but on twitter we really want people to get an opportunity to vote
-    if duck.scenario and (now() > duck.next_active):
-        latest_tweet = get_latest_duck_tweet()
-
-    if latest_tweet:
-        replies = [
-            s for s in twitter.mentions_timeline(
-                since_id=latest_tweet.id,
-                tweet_mode='extended',
-            ) if s.in_reply_to_status_id == latest_tweet.id
-        ] if duck.scenario and latest_tweet else []
-
-        votes = {}
-
-        for reply in replies:
-            if reply.user.id in votes:
-                continue
-
-            answer = duck.scenario.answer_for(reply.full_text)
-            if answer is None:
-                continue
-            votes[reply.user.id] = answer['answer']
-
-        if votes:
-            counter = Counter(votes.values())
-            most_common, = counter.most_common(1)
-            response, _ = most_common
-        else:
-            response = None
+    if now() > duck.next_active:
+        return votes.winner(), votes.prompt
     else:
-        response = None
+        return None, votes.prompt
+
+
+def tick(duck, journey):
+    """
+    Do whatever needs doing to duck, tweet about it and save it, returning
+    the id of the journey it was saved as.
+    """
+
+    response, prompt = tally_votes(duck)
 
     image = None
-    if filename is None:
+    if journey is None:
         # this is a fresh duck! we want an image of it at the start point
         image = duck.make_image()
 
@@ -113,19 +134,98 @@ if __name__ == '__main__':
                 image is None
             ):
                 twitter.update_status(
-                    string,
-                    in_reply_to_status_id=latest_tweet.id
-                    if latest_tweet else None
+                    string, in_reply_to_status_id=prompt,
                 )
             else:
                 if image is None:
                     image = duck.make_image()
 
-                image.save(DUCK_IMAGE_LOCATION)
-                twitter.update_with_media(DUCK_IMAGE_LOCATION, string)
+                filename, f = encode_image(image)
+                status = twitter.update_with_media(filename, string, file=f)
+
+                if duck.scenario is not None:
+                    # this is a question, so replies to it are votes
+                    votes.open(status.id)
+
+        if duck.scenario is None and prompt is not None:
+            votes.close()
 
-    if filename is None:
-        filename = '{}.yaml'.format(now().isoformat())
+    if image is not None:
+        print('image cache: {}'.format(network.image_cache.stats()))
 
-    with open(os.path.join(DUCK_DIR, filename), 'w') as f:
-        f.write(camel.dump(duck))
+    return storage.save(
+        dump_duck(duck), timestamp=now().isoformat(),
+        success=duck.success, journey=journey,
+    )
+
+
+def run_forever():
+    """
+    Keep the duck in memory and tick it whenever it's due, checking in every
+    POLL_INTERVAL hours regardless, until we're told to stop.
+    """
+
+    loop = asyncio.new_event_loop()
+
+    # storage and votes keep sqlite connections, which only work from the
+    # thread that opened them, so everything that touches them happens here
+    worker = ThreadPoolExecutor(max_workers=1)
+
+    def step(duck, journey):
+        if duck is None:
+            duck, journey = get_duck()
+
+        journey = tick(duck, journey)
+
+        if duck.success is not None:
+            duck, journey = duck.make_successor(), None
+
+        return duck, journey
+
+    async def run():
+        stopping = asyncio.Event()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+
+        assets.warm()
+        duck, journey = None, None
+
+        while not stopping.is_set():
+            try:
+                duck, journey = await loop.run_in_executor(
+                    worker, step, duck, journey,
+                )
+            except Exception:
+                # try again next time rather than leaving the duck stranded,
+                # starting from what we last saved; the duck we have may have
+                # got half way through a tick that nobody saw
+                traceback.print_exc()
+                duck, journey = None, None
+
+            delay = POLL_INTERVAL * 60 * 60
+
+            if duck is not None:
+                delay = min(
+                    (duck.next_active - now()).total_seconds(), delay,
+                )
+
+            try:
+                await asyncio.wait_for(stopping.wait(), max(1, delay))
+            except asyncio.TimeoutError:
+                pass
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        worker.shutdown()
+        loop.close()
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if '--daemon' in argv[1:]:
+        run_forever()
+    else:
+        tick(*get_duck())
@@ -0,0 +1,126 @@
+import sqlite3
+from collections import Counter
+
+import tweepy
+
+
+class VoteCollector:
+    """
+    Votes on the scenario currently being asked about, gathered a few new
+    mentions at a time and tallied in an SQLite database, along with which
+    tweet asked the question and the newest mention we've already seen.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.location)
+            with self._db:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS vote_state ('
+                    'name TEXT PRIMARY KEY, '
+                    'value INTEGER'
+                    ')'
+                )
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS votes ('
+                    'prompt INTEGER NOT NULL, '
+                    'user INTEGER NOT NULL, '
+                    'answer TEXT NOT NULL, '
+                    'PRIMARY KEY (prompt, user)'
+                    ')'
+                )
+
+        return self._db
+
+    def _get(self, name):
+        row = self._connect().execute(
+            'SELECT value FROM vote_state WHERE name = ?', (name,),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _set(self, name, value):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO vote_state (name, value) VALUES (?, ?)',
+            (name, value),
+        )
+
+    @property
+    def prompt(self):
+        """
+        The id of the tweet we're collecting replies to, if any.
+        """
+
+        return self._get('prompt')
+
+    def open(self, prompt):
+        with self._connect():
+            self._set('prompt', prompt)
+            # replies to the prompt can't be older than it, so there's no
+            # sense in going back any further
+            self._set('cursor', max(self._get('cursor') or 0, prompt))
+
+    def close(self):
+        with self._connect():
+            self._set('prompt', None)
+
+    def collect(self, api, scenario):
+        """
+        Fetch every mention we haven't seen yet, however many pages that
+        takes, and count any that are replies to the prompt as votes.
+        """
+
+        prompt = self.prompt
+        if prompt is None:
+            return
+
+        mentions = list(tweepy.Cursor(
+            api.mentions_timeline,
+            since_id=self._get('cursor'),
+            tweet_mode='extended',
+            count=200,
+        ).items())
+
+        if not mentions:
+            return
+
+        db = self._connect()
+
+        # oldest first, so that each person's most recent vote counts
+        replies = [
+            m for m in reversed(mentions) if m.in_reply_to_status_id == prompt
+        ]
+        answers = scenario.answers_for([m.full_text for m in replies])
+
+        with db:
+            for mention, answer in zip(replies, answers):
+                if answer is None:
+                    continue
+
+                db.execute(
+                    'INSERT OR REPLACE INTO votes (prompt, user, answer) '
+                    'VALUES (?, ?, ?)',
+                    (prompt, mention.user.id, answer['answer']),
+                )
+
+            self._set('cursor', max(m.id for m in mentions))
+
+    def tally(self):
+        return Counter(dict(self._connect().execute(
+            'SELECT answer, COUNT(*) FROM votes WHERE prompt = ? '
+            'GROUP BY answer ORDER BY MIN(rowid)', (self.prompt,),
+        )))
+
+    def winner(self):
+        """
+        Return the most popular answer so far, or None if nobody has voted.
+        """
+
+        most_common = self.tally().most_common(1)
+
+        if most_common:
+            (response, _), = most_common
+            return response